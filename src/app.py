@@ -1,28 +1,83 @@
 from __future__ import annotations
-import random
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any
+from collections.abc import Mapping
+from typing import List, Dict, Any, Optional, Tuple
 
-from flask import Flask, jsonify, request, abort
+import orjson
+from flask import Flask, Response, request, abort, stream_with_context
 from config import Config
-from extensions import db
-from models import KeyPair
-from helpers import now_utc, generate_kid_non_colliding
-from strategies import registry, RSAKeyStrategy, Ed25519KeyStrategy, ECP256KeyStrategy
+from extensions import db, enable_sqlite_savepoints
+from models import KeyPair, upgrade_schema
+from helpers import now_utc, insert_with_unique_kid, encode_cursor, decode_cursor
+from strategies import registry, RSAKeyPool, RSAKeyStrategy, Ed25519KeyStrategy, ECP256KeyStrategy
 from repositories import KeyRepository, SQLAlchemyKeyRepository
 from repositories_psycopg import PsycopgKeyRepository
+from cache import JWKSCache, NullJWKSCache, RedisJWKSCache
 
 # NEW
 from auth import InMemoryAuthRepository, AWSSecretsAuthRepository, make_require_roles
 
+def _json(obj: Any, status: int = 200) -> Response:
+    # orjson: native encoder, serializes datetime as RFC 3339 (same as .isoformat())
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+_SUMMARY_FIELDS = ("tenant_id", "key_id", "key_type", "curve", "key_size", "created_at", "expires_at", "active")
+
+def _field(r, name: str) -> Any:
+    # Rows are ORM objects (SQLAlchemy repo) or dict_row mappings (psycopg repo).
+    return r[name] if isinstance(r, Mapping) else getattr(r, name)
+
+def _key_summary(r) -> Dict[str, Any]:
+    return {name: _field(r, name) for name in _SUMMARY_FIELDS}
+
+# Legacy JWKS rows (no stored jwk_json) need a PEM parse each; large batches fan out to a
+# shared pool since the crypto backend does the parsing in native code.
+JWKS_PARALLEL_MIN = 8
+_jwk_pool: Optional[ThreadPoolExecutor] = None
+_jwk_pool_lock = threading.Lock()
+
+def _jwk_executor() -> ThreadPoolExecutor:
+    global _jwk_pool
+    with _jwk_pool_lock:
+        if _jwk_pool is None:
+            _jwk_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="jwks")
+        return _jwk_pool
+
+def _encode_jwks_parts(rows) -> List[bytes]:
+    def from_pem(row) -> bytes:
+        kid, key_type, pem, _ = row
+        return orjson.dumps(registry.get(key_type).to_jwk(pem, kid))
+
+    legacy = [i for i, row in enumerate(rows) if row[3] is None]
+    parts = [None if jwk is None else jwk.encode() for _, _, _, jwk in rows]
+    if len(legacy) >= JWKS_PARALLEL_MIN:
+        encoded = _jwk_executor().map(from_pem, [rows[i] for i in legacy])
+    else:
+        encoded = map(from_pem, (rows[i] for i in legacy))
+    for i, part in zip(legacy, encoded):
+        parts[i] = part
+    return parts
+
+def _prepare_threshold(value: int) -> Optional[int]:
+    # Negative config value turns psycopg server-side prepared statements off.
+    return None if value is None or value < 0 else value
+
 def create_app(config_class=Config) -> Flask:
     app = Flask(__name__)
     app.config.from_object(config_class)
     db.init_app(app)
 
     # Strategies
+    rsa_pool = None
+    if app.config.get("RSA_POOL_TARGET", 0) > 0:
+        rsa_pool = RSAKeyPool(target=app.config["RSA_POOL_TARGET"])
+        rsa_pool.warm(app.config["DEFAULT_KEY_SIZE"])
     registry.register(RSAKeyStrategy(allowed_sizes=app.config["ALLOWED_RSA_SIZES"],
-                                     default_size=app.config["DEFAULT_KEY_SIZE"]))
+                                     default_size=app.config["DEFAULT_KEY_SIZE"], pool=rsa_pool))
     registry.register(Ed25519KeyStrategy())
     registry.register(ECP256KeyStrategy())
 
@@ -31,11 +86,15 @@ def create_app(config_class=Config) -> Flask:
     if storage == "sqlalchemy":
         repo: KeyRepository = SQLAlchemyKeyRepository()
         with app.app_context():
+            enable_sqlite_savepoints(db.engine)
             db.create_all()
+            upgrade_schema(db.engine)
     elif storage == "psycopg":
-        # Psycopg repo manages its own table DDL if missing
+        # Psycopg repo creates its table if missing; older tables are upgraded by `flask migrate-schema`
         dsn = app.config["POSTGRES_DSN"]
-        repo = PsycopgKeyRepository(dsn)
+        repo = PsycopgKeyRepository(dsn, min_size=app.config.get("PG_POOL_MIN", 2),
+                                    max_size=app.config.get("PG_POOL_MAX", 10),
+                                    prepare_threshold=_prepare_threshold(app.config.get("PG_PREPARE_THRESHOLD", 1)))
     else:
         raise RuntimeError(f"Unsupported STORAGE_BACKEND={storage}")
 
@@ -44,36 +103,54 @@ def create_app(config_class=Config) -> Flask:
     if auth_backend == "aws":
         import boto3
         sm = boto3.client("secretsmanager", region_name=app.config["AWS_REGION"])
-        auth_repo = AWSSecretsAuthRepository(sm, app.config["AWS_SECRETS_PREFIX"])
+        auth_repo = AWSSecretsAuthRepository(sm, app.config["AWS_SECRETS_PREFIX"],
+                                             cache_ttl=app.config.get("AWS_SECRETS_CACHE_TTL", 300))
     elif auth_backend == "inmemory":
         auth_repo = InMemoryAuthRepository(app.config.get("INMEM_ACCOUNTS", {}))
     else:
         raise RuntimeError(f"Unsupported AUTH_BACKEND={auth_backend}")
 
-    require_roles = make_require_roles(auth_repo)
+    require_roles = make_require_roles(auth_repo, cache_ttl=app.config.get("AUTH_PRINCIPAL_CACHE_TTL", 60))
+
+    # ---- JWKS cache selection
+    jwks_ttl = int(app.config.get("JWKS_CACHE_TTL", 300))
+    cache_backend = app.config.get("JWKS_CACHE_BACKEND", "none")
+    if cache_backend == "redis":
+        import redis
+        client = redis.Redis.from_url(
+            app.config["REDIS_URL"],
+            socket_connect_timeout=app.config.get("REDIS_CONNECT_TIMEOUT", 0.25),
+            socket_timeout=app.config.get("REDIS_SOCKET_TIMEOUT", 0.25),
+        )
+        jwks_cache: JWKSCache = RedisJWKSCache(client, jwks_ttl)
+    elif cache_backend == "none":
+        jwks_cache = NullJWKSCache()
+    else:
+        raise RuntimeError(f"Unsupported JWKS_CACHE_BACKEND={cache_backend}")
+
+    @app.cli.command("migrate-schema")
+    def migrate_schema_command():
+        """One-off upgrade of an existing key_pairs table (added columns, covering index)."""
+        if isinstance(repo, PsycopgKeyRepository):
+            repo.migrate_schema()
+        else:
+            upgrade_schema(db.engine)
 
     # ---------------- routes ----------------
     @app.get("/health")
     def health():
-        return jsonify({"status": "ok"})
+        return _json({"status": "ok"})
 
-    @app.post("/tenants/<tenant_id>/keys")
-    @require_roles("create", "admin")   # client must have one of these roles (or admin_global)
-    def create_key(tenant_id: str):
-        payload = request.get_json(silent=True) or {}
+    def _mint(tenant_id: str, payload: Dict[str, Any], *,
+              deactivate_others: bool = False) -> Tuple[Dict[str, Any], KeyPair]:
+        """Validate the payload, generate and store a new KeyPair; return (response body, kp)."""
         key_type = (payload.get("key_type") or app.config["DEFAULT_KEY_TYPE"]).lower()
         key_size = payload.get("key_size")
         duration_days = int(payload.get("duration_days", app.config["DEFAULT_DURATION_DAYS"]))
 
-        # key_id
-        if payload.get("key_id") is None:
-            kid = generate_kid_non_colliding(tenant_id, repo.exists)
-        else:
-            kid = payload["key_id"]
-            if not isinstance(kid, int):
-                abort(400, description="key_id must be an integer")
-            if repo.exists(tenant_id, kid):
-                abort(409, description="A key with this key_id already exists for this tenant")
+        requested_kid = payload.get("key_id")
+        if requested_kid is not None and not isinstance(requested_kid, int):
+            abort(400, description="key_id must be an integer")
         if duration_days <= 0:
             abort(400, description="duration_days must be positive")
 
@@ -86,28 +163,49 @@ def create_app(config_class=Config) -> Flask:
 
         now = now_utc()
         kp = KeyPair(
-            tenant_id=tenant_id, key_id=kid, key_type=key_type, curve=meta.get("curve"),
+            tenant_id=tenant_id, key_id=requested_kid, key_type=key_type, curve=meta.get("curve"),
             private_key_pem=priv_pem, public_key_pem=pub_pem, key_size=meta.get("key_size"),
             created_at=now, expires_at=now + timedelta(days=duration_days), active=True
         )
-        repo.create(kp)
-        return jsonify({
-            "tenant_id": tenant_id, "key_id": kid, "key_type": key_type,
+
+        def insert(kid: int) -> bool:
+            # The JWK is computed once here and served verbatim by /jwks.json.
+            kp.key_id = kid
+            jwk = (strategy.to_jwk_from_components(meta["jwk"], kid) if meta.get("jwk")
+                   else strategy.to_jwk(pub_pem, kid))
+            kp.jwk_json = orjson.dumps(jwk).decode()
+            return repo.create(kp, deactivate_others=deactivate_others) is not None
+
+        # key_id: the insert itself detects (tenant_id, key_id) collisions
+        if requested_kid is None:
+            insert_with_unique_kid(insert)
+        elif not insert(requested_kid):
+            abort(409, description="A key with this key_id already exists for this tenant")
+
+        body = {
+            "tenant_id": tenant_id, "key_id": kp.key_id, "key_type": key_type,
             "key_size": meta.get("key_size"), "curve": meta.get("curve"), "alg": meta.get("alg"),
-            "created_at": kp.created_at.isoformat(), "expires_at": kp.expires_at.isoformat(), "active": kp.active
-        }), 201
+            "created_at": kp.created_at, "expires_at": kp.expires_at, "active": kp.active
+        }
+        return body, kp
+
+    @app.post("/tenants/<tenant_id>/keys")
+    @require_roles("create", "admin")   # client must have one of these roles (or admin_global)
+    def create_key(tenant_id: str):
+        payload = request.get_json(silent=True) or {}
+        body, _ = _mint(tenant_id, payload)
+        jwks_cache.invalidate(tenant_id)
+        return _json(body, 201)
 
     @app.post("/tenants/<tenant_id>/keys/rotate")
     @require_roles("rotate", "admin")
     def rotate_key(tenant_id: str):
         payload = request.get_json(silent=True) or {}
         deactivate_prev = bool(payload.get("deactivate_previous", False))
-        # Reuse create_key impl without re-checking auth
-        resp = create_key.__wrapped__(tenant_id)  # type: ignore[attr-defined]
-        new_kid = resp[0].get_json()["key_id"]
-        if deactivate_prev:
-            repo.deactivate_others(tenant_id, new_kid, now_utc())
-        return resp
+        # Insert + deactivation of the previous keys happen in one transaction.
+        body, _ = _mint(tenant_id, payload, deactivate_others=deactivate_prev)
+        jwks_cache.invalidate(tenant_id)
+        return _json(body, 201)
 
     @app.post("/tenants/<tenant_id>/keys/<int:key_id>/disable")
     @require_roles("disable", "admin")
@@ -117,32 +215,68 @@ def create_app(config_class=Config) -> Flask:
             abort(404, description="Key not found")
         kp.active = False
         repo.save(kp)
-        return jsonify({"tenant_id": tenant_id, "key_id": key_id, "active": False})
+        jwks_cache.invalidate(tenant_id)
+        return _json({"tenant_id": tenant_id, "key_id": key_id, "active": False})
 
     @app.get("/tenants/<tenant_id>/.well-known/jwks.json")
     # public exposure of active keys is often public; keep unauthenticated by default.
     def jwks(tenant_id: str):
-        keys = repo.get_active_unexpired(tenant_id, now_utc())
-        jwks_keys = [registry.get(k.key_type).to_jwk(k.public_key_pem, k.key_id) for k in keys]
-        return jsonify({"keys": jwks_keys})
+        body, generation = jwks_cache.get(tenant_id)
+        if body is None:
+            keys = repo.list_public_for_jwks(tenant_id, now_utc())
+            body = b'{"keys":[' + b",".join(_encode_jwks_parts(keys)) + b"]}"
+            jwks_cache.set(tenant_id, body, generation)
+        resp = Response(body, mimetype="application/json")
+        resp.set_etag(hashlib.sha256(body).hexdigest())
+        resp.headers["Cache-Control"] = f"public, max-age={jwks_ttl}"
+        # Honors If-None-Match: repeat callers holding the current ETag get an empty 304.
+        return resp.make_conditional(request)
 
-    @app.get("/tenants/<tenant_id>/keys")
-    @require_roles("view", "admin")   # admin list endpoint
-    def list_keys(tenant_id: str):
+    def _list_filters() -> Tuple[Optional[bool], bool]:
         active_param = request.args.get("active")
         active = None if active_param is None else active_param.lower() == "true"
         include_expired = request.args.get("include_expired", "false").lower() == "true"
+        return active, include_expired
+
+    @app.get("/tenants/<tenant_id>/keys")
+    @require_roles("view", "admin")   # admin list endpoint
+    def list_keys(tenant_id: str):
+        active, include_expired = _list_filters()
         limit = min(int(request.args.get("limit", app.config["LIST_DEFAULT_LIMIT"])), app.config["LIST_MAX_LIMIT"])
+        if limit < 1:
+            abort(400, description="limit must be at least 1")
         offset = int(request.args.get("offset", 0))
 
+        # Keyset cursor (preferred): opaque `cursor` from a previous page, or explicit after_* params.
+        after = None
+        try:
+            if request.args.get("cursor"):
+                after = decode_cursor(request.args["cursor"])
+            elif request.args.get("after_created_at") and request.args.get("after_id"):
+                after = (datetime.fromisoformat(request.args["after_created_at"]),
+                         int(request.args["after_id"]))
+        except ValueError:
+            abort(400, description="Invalid pagination cursor")
+
         rows, total = repo.list_keys(tenant_id, active=active, include_expired=include_expired,
-                                     now=now_utc(), limit=limit, offset=offset)
-        items = [{
-            "tenant_id": r.tenant_id, "key_id": r.key_id, "key_type": r.key_type, "curve": r.curve,
-            "key_size": r.key_size, "created_at": r.created_at.isoformat(),
-            "expires_at": r.expires_at.isoformat(), "active": r.active
-        } for r in rows]
-        return jsonify({"total": total, "items": items, "limit": limit, "offset": offset})
+                                     now=now_utc(), limit=limit, offset=offset, after=after)
+        items = [_key_summary(r) for r in rows]
+        next_cursor = encode_cursor(_field(rows[-1], "created_at"), _field(rows[-1], "id")) if rows and len(rows) == limit else None
+        return _json({"total": total, "items": items, "limit": limit, "offset": offset,
+                      "next_cursor": next_cursor})
+
+    @app.get("/tenants/<tenant_id>/keys/stream")
+    @require_roles("view", "admin")
+    def stream_keys(tenant_id: str):
+        # Unpaginated NDJSON export; rows are fetched and encoded incrementally.
+        active, include_expired = _list_filters()
+        rows = repo.iter_keys(tenant_id, active=active, include_expired=include_expired, now=now_utc())
+
+        def generate():
+            for r in rows:
+                yield orjson.dumps(_key_summary(r)) + b"\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
     return app
 
@@ -1,9 +1,14 @@
 from __future__ import annotations
 import base64
+import hashlib
+import hmac
 import json
+import os
+import threading
 from abc import ABC, abstractmethod
 from typing import Optional, Tuple, Dict, Any, Iterable
 
+from cachetools import TTLCache
 from flask import request, abort
 
 # ---------- Repository interface ----------
@@ -15,6 +20,12 @@ class AuthRepository(ABC):
         """
         ...
 
+def _secret_matches(expected: Any, provided: str) -> bool:
+    # Constant-time comparison; bytes so non-ASCII secrets don't raise.
+    if not isinstance(expected, str):
+        return False
+    return hmac.compare_digest(expected.encode("utf-8"), provided.encode("utf-8"))
+
 # ---------- In-memory implementation (tests/dev) ----------
 class InMemoryAuthRepository(AuthRepository):
     """
@@ -27,7 +38,7 @@ class InMemoryAuthRepository(AuthRepository):
         rec = self.accounts.get(client_id)
         if not rec:
             return None
-        if rec.get("client_secret") != client_secret:
+        if not _secret_matches(rec.get("client_secret"), client_secret):
             return None
         return {"tenant_id": rec.get("tenant_id"), "roles": list(rec.get("roles", []))}
 
@@ -37,22 +48,48 @@ class AWSSecretsAuthRepository(AuthRepository):
     Looks up secrets by name: f\"{prefix}/{client_id}\"
     Secret value should be a JSON object: {"client_secret":"...","tenant_id":"...","roles":["..."]}
     """
-    def __init__(self, boto3_client, secret_prefix: str):
+    def __init__(self, boto3_client, secret_prefix: str, *, cache_ttl: int = 300,
+                 negative_ttl: int = 30, cache_maxsize: int = 4096):
         self.client = boto3_client
         self.prefix = secret_prefix.rstrip("/")
+        # Per-process caches of parsed secrets (and of unknown client_ids, briefly).
+        self._cache: TTLCache = TTLCache(maxsize=cache_maxsize, ttl=cache_ttl)
+        self._missing: TTLCache = TTLCache(maxsize=cache_maxsize, ttl=negative_ttl)
+        self._lock = threading.Lock()
 
-    def authenticate(self, client_id: str, client_secret: str) -> Optional[Dict[str, Any]]:
+    def _lookup(self, client_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            data = self._cache.get(client_id)
+            if data is not None or client_id in self._missing:
+                return data
         name = f"{self.prefix}/{client_id}"
         try:
             resp = self.client.get_secret_value(SecretId=name)
-        except Exception:
+        except Exception as e:
+            # Only a definite "no such secret" is cached; transient AWS errors are retried next call.
+            code = getattr(e, "response", {}).get("Error", {}).get("Code")
+            if code == "ResourceNotFoundException":
+                with self._lock:
+                    self._missing[client_id] = True
             return None
         blob = resp.get("SecretString") or ""
         try:
             data = json.loads(blob)
         except Exception:
+            data = None
+        with self._lock:
+            if isinstance(data, dict):
+                self._cache[client_id] = data
+            else:
+                data = None
+                self._missing[client_id] = True
+        return data
+
+    def authenticate(self, client_id: str, client_secret: str) -> Optional[Dict[str, Any]]:
+        data = self._lookup(client_id)
+        if data is None:
             return None
-        if data.get("client_secret") != client_secret:
+        if not _secret_matches(data.get("client_secret"), client_secret):
             return None
         return {"tenant_id": data.get("tenant_id"), "roles": list(data.get("roles", []))}
 
@@ -90,13 +127,33 @@ def get_client_credentials_from_request() -> Optional[Tuple[str, str]]:
     return None
 
 # ---------- Decorator factory ----------
-def make_require_roles(auth_repo: AuthRepository):
+def make_require_roles(auth_repo: AuthRepository, *, cache_ttl: int = 60, cache_maxsize: int = 8192):
     """
     Returns a decorator @require_roles('create','admin') enforcing:
     - client_id/secret present & valid
     - tenant_id in secret matches the <tenant_id> path param (unless role 'admin_global')
     - intersection(roles, required_roles) or role 'admin' passes
+    Successful authentications are cached for cache_ttl seconds (0 disables),
+    keyed by a keyed hash of client_id:secret so raw secrets are never stored.
     """
+    principals: Optional[TTLCache] = TTLCache(maxsize=cache_maxsize, ttl=cache_ttl) if cache_ttl > 0 else None
+    lock = threading.Lock()
+    hash_key = os.urandom(32)
+
+    def resolve(client_id: str, client_secret: str) -> Optional[Dict[str, Any]]:
+        if principals is None:
+            return auth_repo.authenticate(client_id, client_secret)
+        raw = client_id.encode("utf-8") + b"\0" + client_secret.encode("utf-8")
+        key = hashlib.blake2b(raw, digest_size=16, key=hash_key).digest()
+        with lock:
+            principal = principals.get(key)
+        if principal is None:
+            principal = auth_repo.authenticate(client_id, client_secret)
+            if principal:
+                with lock:
+                    principals[key] = principal
+        return principal
+
     def decorator(*required_roles: str):
         required = set(required_roles)
         def wrapper(fn):
@@ -107,7 +164,7 @@ def make_require_roles(auth_repo: AuthRepository):
                 if not creds:
                     abort(401, description="Missing credentials")
                 client_id, client_secret = creds
-                principal = auth_repo.authenticate(client_id, client_secret)
+                principal = resolve(client_id, client_secret)
                 if not principal:
                     abort(401, description="Invalid credentials")
                 # tenant check unless admin_global
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ---------- Cache interface ----------
+class JWKSCache(ABC):
+    @abstractmethod
+    def get(self, tenant_id: str) -> Tuple[Optional[bytes], Any]:
+        """
+        (serialized JWKS body or None on a miss, generation token). Read the token before the DB
+        so set() can drop a body built from a read that an invalidate() overtook.
+        """
+
+    @abstractmethod
+    def set(self, tenant_id: str, body: bytes, generation: Any) -> None: ...
+
+    @abstractmethod
+    def invalidate(self, tenant_id: str) -> None: ...
+
+# ---------- No-op implementation (default) ----------
+class NullJWKSCache(JWKSCache):
+    def get(self, tenant_id: str) -> Tuple[Optional[bytes], Any]:
+        return None, None
+
+    def set(self, tenant_id: str, body: bytes, generation: Any) -> None:
+        pass
+
+    def invalidate(self, tenant_id: str) -> None:
+        pass
+
+# ---------- Redis implementation ----------
+class RedisJWKSCache(JWKSCache):
+    """
+    Stores the serialized JWKS body under f"{prefix}:{tenant_id}" with a TTL, tagged with the
+    tenant's generation counter f"{prefix}:{tenant_id}:gen". invalidate() bumps the counter, so
+    an entry set by a reader that missed before the write is never served (one MGET per lookup).
+    Redis errors on get/set are treated as cache misses so the endpoint keeps serving from the DB;
+    failed invalidations are logged, since the previous body may stay served until its TTL.
+    """
+    def __init__(self, redis_client, ttl: int, prefix: str = "jwks"):
+        self.client = redis_client
+        self.ttl = ttl
+        self.prefix = prefix.rstrip(":")
+
+    def _key(self, tenant_id: str) -> str:
+        return f"{self.prefix}:{tenant_id}"
+
+    def _gen_key(self, tenant_id: str) -> str:
+        return f"{self.prefix}:{tenant_id}:gen"
+
+    def get(self, tenant_id: str) -> Tuple[Optional[bytes], Any]:
+        try:
+            generation, entry = self.client.mget(self._gen_key(tenant_id), self._key(tenant_id))
+        except Exception:
+            return None, None
+        generation = generation or b"0"
+        if entry is not None:
+            tag, _, body = entry.partition(b":")
+            if tag == generation:
+                return body, generation
+        return None, generation
+
+    def set(self, tenant_id: str, body: bytes, generation: Any) -> None:
+        if generation is None:  # lookup failed; don't guess the generation
+            return
+        try:
+            self.client.set(self._key(tenant_id), generation + b":" + body, ex=self.ttl)
+        except Exception:
+            pass
+
+    def invalidate(self, tenant_id: str) -> None:
+        try:
+            self.client.incr(self._gen_key(tenant_id))
+        except Exception:
+            logger.warning("JWKS cache invalidation failed for tenant %s", tenant_id, exc_info=True)
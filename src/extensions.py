@@ -1,4 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 # create SQLAlchemy instance but don't tie it to any app yet
 db = SQLAlchemy()
+
+def enable_sqlite_savepoints(engine) -> None:
+    """
+    pysqlite defers BEGIN until the first DML, so a SAVEPOINT opened first becomes the outermost
+    transaction and its RELEASE commits on its own. Emit BEGIN ourselves (SQLAlchemy's documented
+    recipe) so begin_nested() really nests inside the session's transaction. No-op off SQLite.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    def on_connect(dbapi_conn, _record):
+        dbapi_conn.isolation_level = None
+
+    def on_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "begin", on_begin)
@@ -1,23 +1,44 @@
 import base64
-import random
+import secrets
 from datetime import datetime, timezone
 
 def b64url(data: bytes) -> str:
     return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
 
 def b64url_uint(n: int) -> str:
-    l = (n.bit_length() + 7) // 8
+    # Minimal big-endian octets (RFC 7518 §2); zero still encodes as one octet.
+    l = (n.bit_length() + 7) // 8 or 1
     return b64url(n.to_bytes(l, "big"))
 
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Opaque keyset cursor for (created_at, id) pagination."""
+    return b64url(f"{created_at.isoformat()}:{row_id}".encode())
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError on malformed input."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        created_at, row_id = raw.rsplit(":", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
 def now_utc():
     return datetime.now(timezone.utc)
 
-def generate_kid_non_colliding(tenant_id: str, exists_fn, attempts: int = 24) -> int:
+KID_MIN, KID_MAX = 10_000_000, 9_999_999_999
+
+def _random_kid() -> int:
+    # secrets: CSPRNG, no shared Mersenne Twister state across worker threads
+    return KID_MIN + secrets.randbelow(KID_MAX - KID_MIN + 1)
+
+def insert_with_unique_kid(insert_fn, attempts: int = 24) -> int:
     """
-    exists_fn(tenant_id: str, kid: int) -> bool
+    insert_fn(kid: int) -> bool; stores the row under kid, False on a (tenant_id, key_id) conflict.
+    Collision detection is left to the insert itself (no pre-check round-trip, no TOCTOU window).
     """
     for _ in range(attempts):
-        cand = random.randint(10_000_000, 9_999_999_999)
-        if not exists_fn(tenant_id, cand):
+        cand = _random_kid()
+        if insert_fn(cand):
             return cand
     raise RuntimeError("Failed to generate a unique key_id; try again.")
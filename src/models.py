@@ -1,11 +1,12 @@
 from datetime import datetime, timezone
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, inspect
 from extensions import db
 
 class KeyPair(db.Model):
     __tablename__ = "key_pairs"
 
-    id = db.Column(db.Integer, primary_key=True)
+    # BIGINT like the Postgres DDL; SQLite only autoincrements an INTEGER PRIMARY KEY.
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
     tenant_id = db.Column(db.String(255), nullable=False, index=True)
     key_id = db.Column(db.Integer, nullable=False)
 
@@ -20,9 +21,32 @@ class KeyPair(db.Model):
                            default=lambda: datetime.now(timezone.utc))
     expires_at = db.Column(db.DateTime(timezone=True), nullable=False)
     active     = db.Column(db.Boolean, nullable=False, default=True)
+    jwk_json   = db.Column(db.Text, nullable=True)  # public JWK serialized at creation; NULL on legacy rows
 
-    __table_args__ = (UniqueConstraint("tenant_id", "key_id", name="uq_tenant_kid"),)
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "key_id", name="uq_tenant_kid"),
+        # Covering index for JWKS/list reads; INCLUDE is Postgres-only and ignored elsewhere.
+        db.Index("ix_key_pairs_tenant_active_exp", tenant_id, active, expires_at.desc(),
+                 postgresql_include=["key_id", "key_type", "public_key_pem", "jwk_json", "created_at"]),
+    )
 
     @property
     def is_active_now(self) -> bool:
         return self.active and self.expires_at > datetime.now(timezone.utc)
+
+# Columns added after the first release, with their DDL type. create_all() never alters an
+# existing table, so upgrade_schema() adds them (the psycopg counterpart is migrate_schema()).
+ADDED_COLUMNS = {"jwk_json": "TEXT"}
+
+def upgrade_schema(engine) -> None:
+    """Additive upgrade of a pre-existing key_pairs table: missing columns, then missing indexes."""
+    insp = inspect(engine)
+    if not insp.has_table(KeyPair.__tablename__):
+        return
+    present = {c["name"] for c in insp.get_columns(KeyPair.__tablename__)}
+    with engine.begin() as conn:
+        for name, ddl_type in ADDED_COLUMNS.items():
+            if name not in present:
+                conn.exec_driver_sql(f"ALTER TABLE {KeyPair.__tablename__} ADD COLUMN {name} {ddl_type}")
+    for index in KeyPair.__table__.indexes:
+        index.create(engine, checkfirst=True)
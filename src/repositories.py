@@ -1,7 +1,10 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import Iterable, Optional, Tuple
+from typing import Iterable, Iterator, Optional, Tuple
 from datetime import datetime
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from extensions import db
 from models import KeyPair
 
@@ -10,12 +13,25 @@ class KeyRepository(ABC):
     @abstractmethod
     def exists(self, tenant_id: str, key_id: int) -> bool: ...
     @abstractmethod
-    def create(self, kp: KeyPair) -> KeyPair: ...
+    def create(self, kp: KeyPair, *, deactivate_others: bool = False) -> Optional[KeyPair]:
+        """
+        Insert kp; with deactivate_others, also deactivate the tenant's other keys atomically.
+        Returns None (and changes nothing) if the tenant already has a key with kp.key_id.
+        """
+    @abstractmethod
+    def create_many(self, kps: Iterable[KeyPair]) -> list[KeyPair]:
+        """Insert several keys in one transaction; returns those inserted (taken kids are skipped)."""
     @abstractmethod
     def deactivate_others(self, tenant_id: str, exclude_key_id: int, now: datetime) -> int: ...
     @abstractmethod
     def get_active_unexpired(self, tenant_id: str, now: datetime) -> list[KeyPair]: ...
     @abstractmethod
+    def list_public_for_jwks(self, tenant_id: str, now: datetime) -> list[Tuple[int, str, Optional[str], Optional[str]]]:
+        """
+        Active, unexpired keys as (key_id, key_type, public_key_pem, jwk_json), newest first.
+        public_key_pem is only returned for legacy rows without a precomputed jwk_json.
+        """
+    @abstractmethod
     def get_one(self, tenant_id: str, key_id: int) -> Optional[KeyPair]: ...
     @abstractmethod
     def save(self, kp: KeyPair) -> None: ...
@@ -28,27 +44,97 @@ class KeyRepository(ABC):
         include_expired: bool,
         now: datetime,
         limit: int,
-        offset: int
-    ) -> Tuple[list[KeyPair], int]: ...
+        offset: int,
+        after: Optional[Tuple[datetime, int]] = None
+    ) -> Tuple[list[KeyPair], int]:
+        """
+        Page of keys ordered by (created_at DESC, id DESC) plus the total matching count.
+        `after=(created_at, id)` selects the keyset page following that row (preferred over offset).
+        """
+    @abstractmethod
+    def iter_keys(
+        self,
+        tenant_id: str,
+        *,
+        active: Optional[bool],
+        include_expired: bool,
+        now: datetime
+    ) -> Iterator[KeyPair]:
+        """Lazily yield every matching key in list_keys order, without materializing the result."""
 
 # ---------- SQLAlchemy implementation ----------
+def _key_filters(model, tenant_id: str, active: Optional[bool], include_expired: bool, now: datetime) -> list:
+    conds = [model.tenant_id == tenant_id]
+    if active is not None:
+        conds.append(model.active.is_(active))
+    if not include_expired:
+        conds.append(model.expires_at > now)
+    return conds
+
+def _is_kid_conflict(err: IntegrityError) -> bool:
+    """True only for a (tenant_id, key_id) unique violation; NOT NULL etc. are real errors."""
+    diag = getattr(err.orig, "diag", None)  # psycopg / psycopg2 report the constraint name
+    if getattr(diag, "constraint_name", None):
+        return diag.constraint_name == "uq_tenant_kid"
+    msg = str(err.orig)
+    return "uq_tenant_kid" in msg or "key_pairs.tenant_id, key_pairs.key_id" in msg
+
 class SQLAlchemyKeyRepository(KeyRepository):
     def exists(self, tenant_id: str, key_id: int) -> bool:
         return db.session.query(KeyPair.id).filter_by(tenant_id=tenant_id, key_id=key_id).first() is not None
 
-    def create(self, kp: KeyPair) -> KeyPair:
-        db.session.add(kp)
+    def create(self, kp: KeyPair, *, deactivate_others: bool = False) -> Optional[KeyPair]:
+        # The SAVEPOINT nests in the session transaction (see enable_sqlite_savepoints), so the
+        # insert and _deactivate_others still commit together.
+        try:
+            with db.session.begin_nested():
+                db.session.add(kp)
+        except IntegrityError as e:
+            if not _is_kid_conflict(e):
+                raise
+            # uq_tenant_kid: the savepoint is rolled back and kp is transient again.
+            return None
+        if deactivate_others:
+            self._deactivate_others(kp.tenant_id, kp.key_id)
         db.session.commit()
         return kp
 
+    def create_many(self, kps: Iterable[KeyPair]) -> list[KeyPair]:
+        kps = list(kps)
+        try:
+            with db.session.begin_nested():
+                db.session.add_all(kps)
+            created = kps
+        except IntegrityError as e:
+            if not _is_kid_conflict(e):
+                raise
+            # Some kid is taken: retry row by row so only the conflicting rows are dropped.
+            created = []
+            for kp in kps:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(kp)
+                    created.append(kp)
+                except IntegrityError as row_err:
+                    if not _is_kid_conflict(row_err):
+                        raise
+        db.session.commit()
+        return created
+
+    @staticmethod
+    def _deactivate_others(tenant_id: str, exclude_key_id: int) -> int:
+        # One UPDATE; the driver's rowcount is the result, no candidate SELECT or RETURNING rows.
+        stmt = (update(KeyPair)
+                .where(KeyPair.tenant_id == tenant_id,
+                       KeyPair.active.is_(True),
+                       KeyPair.key_id != exclude_key_id)
+                .values(active=False)
+                .execution_options(synchronize_session=False))
+        return db.session.execute(stmt).rowcount
+
     def deactivate_others(self, tenant_id: str, exclude_key_id: int, now: datetime) -> int:
-        q = KeyPair.query.filter(
-            KeyPair.tenant_id == tenant_id,
-            KeyPair.active.is_(True),
-            KeyPair.expires_at > now,
-            KeyPair.key_id != exclude_key_id,
-        )
-        count = q.update({KeyPair.active: False}, synchronize_session=False)
+        # `now` is kept for interface compatibility; expired keys are flipped too.
+        count = self._deactivate_others(tenant_id, exclude_key_id)
         db.session.commit()
         return count
 
@@ -60,6 +146,15 @@ class SQLAlchemyKeyRepository(KeyRepository):
                 .order_by(KeyPair.created_at.desc())
                 .all())
 
+    def list_public_for_jwks(self, tenant_id: str, now: datetime) -> list[Tuple[int, str, Optional[str], Optional[str]]]:
+        legacy_pem = case((KeyPair.jwk_json.is_(None), KeyPair.public_key_pem))
+        return (db.session.query(KeyPair.key_id, KeyPair.key_type, legacy_pem, KeyPair.jwk_json)
+                .filter(KeyPair.tenant_id == tenant_id,
+                        KeyPair.active.is_(True),
+                        KeyPair.expires_at > now)
+                .order_by(KeyPair.created_at.desc())
+                .all())
+
     def get_one(self, tenant_id: str, key_id: int) -> Optional[KeyPair]:
         return KeyPair.query.filter_by(tenant_id=tenant_id, key_id=key_id).first()
 
@@ -68,17 +163,43 @@ class SQLAlchemyKeyRepository(KeyRepository):
         db.session.commit()
 
     def list_keys(self, tenant_id: str, *, active: Optional[bool], include_expired: bool,
-                  now: datetime, limit: int, offset: int) -> Tuple[list[KeyPair], int]:
-        q = KeyPair.query.filter(KeyPair.tenant_id == tenant_id)
-        if active is not None:
-            q = q.filter(KeyPair.active.is_(active))
-        if not include_expired:
-            q = q.filter(KeyPair.expires_at > now)
-        total = q.count()
-        rows = (q.order_by(KeyPair.created_at.desc())
-                 .offset(offset)
-                 .limit(limit)
-                 .all())
-        return rows, total
+                  now: datetime, limit: int, offset: int,
+                  after: Optional[Tuple[datetime, int]] = None) -> Tuple[list[KeyPair], int]:
+        def filters(model) -> list:
+            return _key_filters(model, tenant_id, active, include_expired, now)
+
+        conds = filters(KeyPair)
+        if after is None:
+            total_col = func.count().over()
+        else:
+            # Keyset page: rows strictly after the cursor; total still counts the whole filter.
+            after_created_at, after_id = after
+            conds.append(or_(KeyPair.created_at < after_created_at,
+                             and_(KeyPair.created_at == after_created_at, KeyPair.id < after_id)))
+            counted = aliased(KeyPair)
+            total_col = select(func.count(counted.id)).where(*filters(counted)).scalar_subquery()
+        # Items and total in one round-trip; KeyPair has no relationships, so nothing lazy-loads.
+        stmt = (select(KeyPair, total_col.label("total"))
+                .where(*conds)
+                .order_by(KeyPair.created_at.desc(), KeyPair.id.desc())
+                .offset(offset)
+                .limit(limit))
+        rows = db.session.execute(stmt).all()
+        if rows:
+            total = rows[0].total
+        elif offset or after is not None:
+            # Past the end: no row carries the count.
+            total = db.session.scalar(select(func.count(KeyPair.id)).where(*filters(KeyPair)))
+        else:
+            total = 0
+        return [r[0] for r in rows], total
+
+    def iter_keys(self, tenant_id: str, *, active: Optional[bool], include_expired: bool,
+                  now: datetime) -> Iterator[KeyPair]:
+        stmt = (select(KeyPair)
+                .where(*_key_filters(KeyPair, tenant_id, active, include_expired, now))
+                .order_by(KeyPair.created_at.desc(), KeyPair.id.desc())
+                .execution_options(yield_per=50))
+        yield from db.session.scalars(stmt)
 
 # Future: DynamoDBKeyRepository, PsycopgKeyRepository, etc.
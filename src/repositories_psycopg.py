@@ -1,41 +1,185 @@
 from __future__ import annotations
-from typing import Optional, Tuple, List
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, Tuple, List, Union
 from datetime import datetime
 import psycopg
-from psycopg.rows import dict_row
+from psycopg import sql
+from psycopg.rows import dict_row, tuple_row
+from psycopg_pool import ConnectionPool
 
 from repositories import KeyRepository
 # We avoid importing SQLAlchemy model here; we return dicts & build KeyPair-like dicts.
 
-DDL = """
-CREATE TABLE IF NOT EXISTS key_pairs (
-    id SERIAL PRIMARY KEY,
-    tenant_id VARCHAR(255) NOT NULL,
-    key_id BIGINT NOT NULL,
-    key_type VARCHAR(32) NOT NULL DEFAULT 'rsa',
-    curve VARCHAR(32),
-    private_key_pem TEXT NOT NULL,
-    public_key_pem  TEXT NOT NULL,
-    key_size INT,
-    created_at TIMESTAMPTZ NOT NULL,
-    expires_at TIMESTAMPTZ NOT NULL,
-    active BOOLEAN NOT NULL DEFAULT TRUE,
-    CONSTRAINT uq_tenant_kid UNIQUE (tenant_id, key_id)
-);
-CREATE INDEX IF NOT EXISTS ix_key_pairs_tenant ON key_pairs(tenant_id);
+HASH_PARTITIONS = 16
+
+COVERING_INDEX = "ix_key_pairs_tenant_active_exp"
+COVERING_INDEX_COLUMNS = ("(tenant_id, active, expires_at DESC) "
+                          "INCLUDE (key_id, key_type, public_key_pem, jwk_json, created_at)")
+
+# key_pairs is hash-partitioned by tenant_id, so every (tenant-scoped) query and index probe
+# touches a single partition. Postgres requires the partition key in every unique constraint,
+# hence PRIMARY KEY (tenant_id, id).
+# Runs on every repository start, so it only ever checks the catalog once the table exists: any
+# DDL against a live key_pairs would queue behind open streams and stall every read behind it.
+# Tables from older releases are upgraded by migrate_schema() instead.
+DDL = f"""
+DO $$
+BEGIN
+    -- Serializes concurrent worker boots on an empty database; key_pairs itself is not locked.
+    PERFORM pg_advisory_xact_lock(hashtext('key_pairs schema'));
+    IF to_regclass('key_pairs') IS NULL THEN
+        CREATE TABLE key_pairs (
+            id BIGSERIAL,
+            tenant_id VARCHAR(255) NOT NULL,
+            key_id BIGINT NOT NULL,
+            key_type VARCHAR(32) NOT NULL DEFAULT 'rsa',
+            curve VARCHAR(32),
+            private_key_pem TEXT NOT NULL,
+            public_key_pem  TEXT NOT NULL,
+            key_size INT,
+            created_at TIMESTAMPTZ NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL,
+            active BOOLEAN NOT NULL DEFAULT TRUE,
+            jwk_json TEXT,
+            PRIMARY KEY (tenant_id, id),
+            CONSTRAINT uq_tenant_kid UNIQUE (tenant_id, key_id)
+        ) PARTITION BY HASH (tenant_id);
+        FOR i IN 0..{HASH_PARTITIONS - 1} LOOP
+            EXECUTE format(
+                'CREATE TABLE key_pairs_p%s PARTITION OF key_pairs '
+                'FOR VALUES WITH (MODULUS {HASH_PARTITIONS}, REMAINDER %s)', i, i);
+        END LOOP;
+        CREATE INDEX {COVERING_INDEX} ON key_pairs {COVERING_INDEX_COLUMNS};
+    END IF;
+END $$;
 """
 
+# Columns added after the first release; the catalog check keeps a re-run lock-free.
+_ADD_COLUMNS = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = 'key_pairs'
+                      AND column_name = 'jwk_json') THEN
+        ALTER TABLE key_pairs ADD COLUMN jwk_json TEXT;
+    END IF;
+END $$;
+"""
+
+def migrate_schema(conn: psycopg.Connection) -> None:
+    """
+    One-off upgrade of a key_pairs table created by an older release (``flask migrate-schema``):
+    adds missing columns, then builds the covering index without blocking key writes, i.e.
+    CONCURRENTLY on each partition, attached to an ON ONLY index on the parent.
+    conn must be in autocommit mode. Safe to re-run.
+    """
+    cur = conn.cursor(row_factory=tuple_row)
+    cur.execute(_ADD_COLUMNS)
+    cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (COVERING_INDEX,))
+    row = cur.fetchone()
+    if row and row[0]:
+        return
+    index, columns = sql.Identifier(COVERING_INDEX), sql.SQL(COVERING_INDEX_COLUMNS)
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'key_pairs'::regclass)")
+    if not cur.fetchone()[0]:
+        cur.execute(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON key_pairs {}").format(index, columns))
+        return
+    cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON ONLY key_pairs {}").format(index, columns))
+    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+                " WHERE i.inhparent = 'key_pairs'::regclass ORDER BY c.relname")
+    for (partition,) in cur.fetchall():
+        part_index = sql.Identifier(f"{partition}_tenant_active_exp_idx")
+        cur.execute(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}")
+                    .format(part_index, sql.Identifier(partition), columns))
+        cur.execute(sql.SQL("ALTER INDEX {} ATTACH PARTITION {}").format(index, part_index))
+
+# ---------- SQL text per filter shape ----------
+# list_keys/iter_keys have a handful of filter shapes, each with its own fixed text.
+# Prepared-statement reuse across calls comes from prepare_threshold (see make_pool).
+def _where_sql(filter_active: bool, include_expired: bool) -> str:
+    wheres = ["tenant_id = %s"]
+    if filter_active:
+        wheres.append("active = %s")
+    if not include_expired:
+        wheres.append("expires_at > %s")
+    return " AND ".join(wheres)
+
+def _list_sql(filter_active: bool, include_expired: bool, keyset: bool) -> Tuple[str, str]:
+    """(page query, fallback count query) for one list_keys shape."""
+    where_sql = _where_sql(filter_active, include_expired)
+    if keyset:
+        # Rows strictly after the cursor; total still counts the whole filter.
+        total_sql = f"(SELECT COUNT(*) FROM key_pairs WHERE {where_sql})"
+        page_where = f"{where_sql} AND (created_at, id) < (%s, %s)"
+    else:
+        total_sql, page_where = "COUNT(*) OVER ()", where_sql
+    page_sql = f"""
+        SELECT *, {total_sql} AS _total FROM key_pairs
+         WHERE {page_where}
+         ORDER BY created_at DESC, id DESC
+         OFFSET %s LIMIT %s;
+    """
+    return page_sql, f"SELECT COUNT(*) AS c FROM key_pairs WHERE {where_sql};"
+
+def _iter_sql(where_sql: str) -> str:
+    return f"SELECT * FROM key_pairs WHERE {where_sql} ORDER BY created_at DESC, id DESC;"
+
+def make_pool(dsn: str, *, min_size: int = 2, max_size: int = 10,
+              prepare_threshold: Optional[int] = 1) -> ConnectionPool:
+    """
+    Connection pool configured the way PsycopgKeyRepository expects (autocommit, dict rows).
+    prepare_threshold: server-side prepare a statement after this many runs on a
+    connection (None disables; needed behind a transaction-pooling pgbouncer).
+    """
+    return ConnectionPool(
+        dsn, min_size=min_size, max_size=max_size, open=True,
+        kwargs={"autocommit": True, "row_factory": dict_row, "prepare_threshold": prepare_threshold},
+    )
+
 class PsycopgKeyRepository(KeyRepository):
     """
     A pure-psycopg implementation of KeyRepository.
     NOTE: We return plain dicts with fields like the SQLAlchemy model.
           The Flask routes only need these fields; no ORM required.
     """
-    def __init__(self, dsn: str):
-        # Use a single connection with autocommit for simplicity.
-        self.conn = psycopg.connect(dsn, autocommit=True, row_factory=dict_row)
-        with self.conn.cursor() as cur:
-            cur.execute(DDL)
+    STREAM_ITERSIZE = 200
+
+    def __init__(self, target: Union[str, ConnectionPool, psycopg.Connection], *, min_size: int = 2,
+                 max_size: int = 10, prepare_threshold: Optional[int] = 1, create_schema: bool = True):
+        # target: a DSN (private pool, closed by close()), a shared ConnectionPool from make_pool(),
+        # or a single dict_row Connection whose open transaction every call joins (tests, batch
+        # jobs). Shared pools/connections are left open for their owner.
+        self.pool: Optional[ConnectionPool] = None
+        self._conn: Optional[psycopg.Connection] = None
+        self._owns_pool = False
+        if isinstance(target, psycopg.Connection):
+            self._conn = target
+        elif isinstance(target, ConnectionPool):
+            self.pool = target
+        else:
+            self.pool = make_pool(target, min_size=min_size, max_size=max_size,
+                                  prepare_threshold=prepare_threshold)
+            self._owns_pool = True
+        if create_schema:
+            with self._connection() as conn:
+                conn.execute(DDL)
+
+    def migrate_schema(self) -> None:
+        """Upgrade an existing key_pairs table; see migrate_schema()."""
+        with self._connection() as conn:
+            migrate_schema(conn)
+
+    def close(self) -> None:
+        if self._owns_pool:
+            self.pool.close()
+
+    @contextmanager
+    def _connection(self) -> Iterator[psycopg.Connection]:
+        if self._conn is not None:
+            yield self._conn
+        else:
+            with self.pool.connection() as conn:
+                yield conn
 
     # --- helpers ---
     @staticmethod
@@ -45,52 +189,101 @@ class PsycopgKeyRepository(KeyRepository):
 
     # --- interface methods ---
     def exists(self, tenant_id: str, key_id: int) -> bool:
-        with self.conn.cursor() as cur:
+        with self._connection() as conn, conn.cursor() as cur:
             cur.execute(
                 "SELECT 1 FROM key_pairs WHERE tenant_id = %s AND key_id = %s LIMIT 1;",
                 (tenant_id, key_id),
             )
             return cur.fetchone() is not None
 
-    def create(self, kp) -> dict:
+    _INSERT = """
+        INSERT INTO key_pairs
+        (tenant_id, key_id, key_type, curve, private_key_pem, public_key_pem,
+         key_size, created_at, expires_at, active, jwk_json)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        ON CONFLICT (tenant_id, key_id) DO NOTHING
+        RETURNING *;
+    """
+
+    @staticmethod
+    def _insert_params(kp) -> tuple:
+        return (
+            kp.tenant_id, kp.key_id, kp.key_type, kp.curve, kp.private_key_pem,
+            kp.public_key_pem, kp.key_size, kp.created_at, kp.expires_at, kp.active,
+            getattr(kp, "jwk_json", None),
+        )
+
+    def create(self, kp, *, deactivate_others: bool = False) -> Optional[dict]:
         # kp is an object (SQLAlchemy model in app), but we only read its attributes.
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO key_pairs
-                (tenant_id, key_id, key_type, curve, private_key_pem, public_key_pem,
-                 key_size, created_at, expires_at, active)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                RETURNING *;
-                """,
-                (
-                    kp.tenant_id, kp.key_id, kp.key_type, kp.curve, kp.private_key_pem,
-                    kp.public_key_pem, kp.key_size, kp.created_at, kp.expires_at, kp.active
-                ),
-            )
+        # A taken (tenant_id, key_id) inserts nothing and returns no row -> None.
+        with self._connection() as conn, conn.transaction(), conn.cursor() as cur:
+            cur.execute(self._INSERT, self._insert_params(kp))
             row = cur.fetchone()
+            if row is None:
+                return None
+            if deactivate_others:
+                self._deactivate_others(cur, kp.tenant_id, kp.key_id)
             return self._row_to_dict(row)
 
+    def create_many(self, kps: Iterable) -> List[dict]:
+        """Insert several keys in one transaction and one pipelined batch; returns the rows
+        actually inserted (kid conflicts are skipped, as in create)."""
+        params = [self._insert_params(kp) for kp in kps]
+        if not params:
+            return []
+        created = []
+        with self._connection() as conn, conn.transaction(), conn.cursor() as cur:
+            cur.executemany(self._INSERT, params, returning=True)
+            while True:
+                row = cur.fetchone()
+                if row is not None:
+                    created.append(self._row_to_dict(row))
+                if not cur.nextset():
+                    break
+        return created
+
+    @staticmethod
+    def _deactivate_others(cur, tenant_id: str, exclude_key_id: int) -> int:
+        cur.execute(
+            """
+            UPDATE key_pairs
+               SET active = FALSE
+             WHERE tenant_id = %s
+               AND active = TRUE
+               AND key_id <> %s;
+            """,
+            (tenant_id, exclude_key_id),
+        )
+        return cur.rowcount
+
     def deactivate_others(self, tenant_id: str, exclude_key_id: int, now: datetime) -> int:
-        with self.conn.cursor() as cur:
+        # `now` is kept for interface compatibility; expired keys are flipped too.
+        with self._connection() as conn, conn.cursor() as cur:
+            return self._deactivate_others(cur, tenant_id, exclude_key_id)
+
+    def get_active_unexpired(self, tenant_id: str, now: datetime) -> List[dict]:
+        with self._connection() as conn, conn.cursor() as cur:
             cur.execute(
                 """
-                UPDATE key_pairs
-                   SET active = FALSE
+                SELECT * FROM key_pairs
                  WHERE tenant_id = %s
                    AND active = TRUE
                    AND expires_at > %s
-                   AND key_id <> %s;
+                 ORDER BY created_at DESC;
                 """,
-                (tenant_id, now, exclude_key_id),
+                (tenant_id, now),
             )
-            return cur.rowcount
+            rows = cur.fetchall()
+            return [self._row_to_dict(r) for r in rows]
 
-    def get_active_unexpired(self, tenant_id: str, now: datetime) -> List[dict]:
-        with self.conn.cursor() as cur:
+    def list_public_for_jwks(self, tenant_id: str, now: datetime) -> List[Tuple[int, str, Optional[str], Optional[str]]]:
+        with self._connection() as conn, conn.cursor(row_factory=tuple_row) as cur:
             cur.execute(
                 """
-                SELECT * FROM key_pairs
+                SELECT key_id, key_type,
+                       CASE WHEN jwk_json IS NULL THEN public_key_pem END AS public_key_pem,
+                       jwk_json
+                  FROM key_pairs
                  WHERE tenant_id = %s
                    AND active = TRUE
                    AND expires_at > %s
@@ -98,11 +291,10 @@ class PsycopgKeyRepository(KeyRepository):
                 """,
                 (tenant_id, now),
             )
-            rows = cur.fetchall()
-            return [self._row_to_dict(r) for r in rows]
+            return cur.fetchall()
 
     def get_one(self, tenant_id: str, key_id: int) -> Optional[dict]:
-        with self.conn.cursor() as cur:
+        with self._connection() as conn, conn.cursor() as cur:
             cur.execute(
                 "SELECT * FROM key_pairs WHERE tenant_id = %s AND key_id = %s;",
                 (tenant_id, key_id),
@@ -112,15 +304,26 @@ class PsycopgKeyRepository(KeyRepository):
 
     def save(self, kp) -> None:
         # kp may be a dict or ORM object; read attributes safely
-        tenant_id = getattr(kp, "tenant_id", kp["tenant_id"])
-        key_id = getattr(kp, "key_id", kp["key_id"])
-        active = getattr(kp, "active", kp["active"])
-        with self.conn.cursor() as cur:
+        if isinstance(kp, dict):
+            tenant_id, key_id, active = kp["tenant_id"], kp["key_id"], kp["active"]
+        else:
+            tenant_id, key_id, active = kp.tenant_id, kp.key_id, kp.active
+        with self._connection() as conn, conn.cursor() as cur:
             cur.execute(
                 "UPDATE key_pairs SET active = %s WHERE tenant_id = %s AND key_id = %s;",
                 (active, tenant_id, key_id),
             )
 
+    @staticmethod
+    def _where(tenant_id: str, active: Optional[bool], include_expired: bool,
+               now: datetime) -> Tuple[str, list]:
+        params = [tenant_id]
+        if active is not None:
+            params.append(active)
+        if not include_expired:
+            params.append(now)
+        return _where_sql(active is not None, include_expired), params
+
     def list_keys(
         self,
         tenant_id: str,
@@ -130,35 +333,42 @@ class PsycopgKeyRepository(KeyRepository):
         now: datetime,
         limit: int,
         offset: int,
+        after: Optional[Tuple[datetime, int]] = None,
     ) -> Tuple[list[dict], int]:
-        wheres = ["tenant_id = %s"]
-        params = [tenant_id]
+        _, params = self._where(tenant_id, active, include_expired, now)
+        page_sql, count_sql = _list_sql(active is not None, include_expired, after is not None)
+        # Keyset page: the total subquery repeats the filter params, then the cursor follows.
+        page_params = [*params] if after is None else [*params, *params, *after]
 
-        if active is not None:
-            wheres.append("active = %s")
-            params.append(active)
-        if not include_expired:
-            wheres.append("expires_at > %s")
-            params.append(now)
-
-        where_sql = " AND ".join(wheres)
-
-        # total count
-        with self.conn.cursor() as cur:
-            cur.execute(f"SELECT COUNT(*) AS c FROM key_pairs WHERE {where_sql};", tuple(params))
-            total = cur.fetchone()["c"]
-
-        # items
-        with self.conn.cursor() as cur:
-            cur.execute(
-                f"""
-                SELECT * FROM key_pairs
-                 WHERE {where_sql}
-                 ORDER BY created_at DESC
-                 OFFSET %s LIMIT %s;
-                """,
-                (*params, offset, limit),
-            )
+        # items + total in one round-trip; an empty page past the end still needs a count
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(page_sql, (*page_params, offset, limit))
             rows = cur.fetchall()
+            if rows:
+                total = rows[0]["_total"]
+            elif offset or after is not None:
+                cur.execute(count_sql, tuple(params))
+                total = cur.fetchone()["c"]
+            else:
+                total = 0
 
+        for r in rows:
+            del r["_total"]
         return [self._row_to_dict(r) for r in rows], int(total)
+
+    def iter_keys(
+        self,
+        tenant_id: str,
+        *,
+        active: Optional[bool],
+        include_expired: bool,
+        now: datetime,
+    ) -> Iterator[dict]:
+        where_sql, params = self._where(tenant_id, active, include_expired, now)
+        # Named (server-side) cursor: rows arrive in itersize batches instead of one buffered
+        # result. Named cursors only live inside a transaction, hence conn.transaction().
+        with self._connection() as conn, conn.transaction(), conn.cursor(name="iter_keys") as cur:
+            cur.itersize = self.STREAM_ITERSIZE
+            cur.execute(_iter_sql(where_sql), tuple(params))
+            for row in cur:
+                yield self._row_to_dict(row)
@@ -1,36 +1,116 @@
 from __future__ import annotations
+import functools
+import queue
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Tuple, Optional
 
 from cryptography.hazmat.primitives.asymmetric import rsa, ed25519, ec
 from cryptography.hazmat.primitives import serialization
 from helpers import b64url, b64url_uint
 
+# ---------- PEM parse cache (process-local) ----------
+@functools.lru_cache(maxsize=2048)
+def _parsed_pub(public_pem: str):
+    return serialization.load_pem_public_key(public_pem.encode())
+
+@functools.lru_cache(maxsize=2048)
+def _cached_jwk(strategy_cls: type, public_pem: str, kid: str) -> Dict[str, Any]:
+    return strategy_cls.to_jwk_from_components(strategy_cls._components(_parsed_pub(public_pem)), kid)
+
 # ---------- Strategy interface ----------
 class KeyStrategy(ABC):
     name: str
+    kty: str
+    alg: str
+    crv: Optional[str] = None
 
     @abstractmethod
     def generate_pair(self, *, key_size: Optional[int] = None) -> Tuple[str, str, Dict[str, Any]]:
-        """Return (private_pem, public_pem, meta: {alg, curve, key_size})"""
+        """Return (private_pem, public_pem, meta: {alg, curve, key_size, jwk: public JWK members})"""
 
-    @abstractmethod
     def to_jwk(self, public_pem: str, kid: str | int) -> Dict[str, Any]:
-        """Convert public PEM to JWK dict."""
+        """Convert public PEM to JWK dict (memoized per (pem, kid); returns a copy). Legacy-row fallback."""
+        return dict(_cached_jwk(type(self), public_pem, str(kid)))
+
+    @classmethod
+    def to_jwk_from_components(cls, components: Dict[str, str], kid: str | int) -> Dict[str, Any]:
+        """Assemble the JWK dict from base64url public members; no crypto involved."""
+        jwk: Dict[str, Any] = {"kty": cls.kty}
+        if cls.crv:
+            jwk["crv"] = cls.crv
+        jwk.update(components)
+        jwk.update({"use": "sig", "alg": cls.alg, "kid": str(kid)})
+        return jwk
+
+    @staticmethod
+    @abstractmethod
+    def _components(pub) -> Dict[str, str]:
+        """Public JWK members of a loaded public key object."""
+
+# ---------- RSA pre-generation pool ----------
+class RSAKeyPool:
+    """
+    Keeps up to `target` pre-generated RSA private keys per size, refilled by background threads.
+    A size starts filling on warm(size) or its first take(size).
+    """
+    def __init__(self, target: int = 8, workers: int = 2):
+        self.target = target
+        self._queues: Dict[int, queue.Queue] = {}
+        self._pending: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rsa-pool")
+
+    def _generate(self, size: int) -> None:
+        try:
+            key = rsa.generate_private_key(public_exponent=65537, key_size=size)
+            self._queues[size].put_nowait(key)
+        finally:
+            with self._lock:
+                self._pending[size] -= 1
+
+    def warm(self, size: int) -> None:
+        with self._lock:
+            q = self._queues.setdefault(size, queue.Queue(maxsize=self.target))
+            missing = self.target - q.qsize() - self._pending.get(size, 0)
+            self._pending[size] = self._pending.get(size, 0) + max(missing, 0)
+        for _ in range(missing):
+            self._executor.submit(self._generate, size)
+
+    def take(self, size: int, timeout: Optional[float] = None):
+        """Pop a ready key (waiting up to `timeout` seconds if given), or None; always schedules a refill."""
+        q = self._queues.get(size)
+        key = None
+        if q is not None:
+            try:
+                key = q.get(timeout=timeout) if timeout else q.get_nowait()
+            except queue.Empty:
+                pass
+        self.warm(size)
+        return key
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
 # ---------- RSA ----------
 class RSAKeyStrategy(KeyStrategy):
     name = "rsa"
+    kty = "RSA"
+    alg = "RS256"
 
-    def __init__(self, allowed_sizes: set[int], default_size: int = 2048):
+    def __init__(self, allowed_sizes: set[int], default_size: int = 2048, pool: Optional[RSAKeyPool] = None):
         self.allowed_sizes = allowed_sizes
         self.default_size = default_size
+        self.pool = pool
 
     def generate_pair(self, *, key_size: Optional[int] = None):
         size = key_size or self.default_size
         if size not in self.allowed_sizes:
             raise ValueError(f"key_size must be one of {sorted(self.allowed_sizes)}")
-        priv = rsa.generate_private_key(public_exponent=65537, key_size=size)
+        priv = self.pool.take(size) if self.pool else None
+        if priv is None:
+            priv = rsa.generate_private_key(public_exponent=65537, key_size=size)
         priv_pem = priv.private_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PrivateFormat.PKCS8,
@@ -40,17 +120,20 @@ class RSAKeyStrategy(KeyStrategy):
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo,
         ).decode()
-        return priv_pem, pub_pem, {"alg": "RS256", "curve": None, "key_size": size}
+        return priv_pem, pub_pem, {"alg": "RS256", "curve": None, "key_size": size,
+                                   "jwk": self._components(priv.public_key())}
 
-    def to_jwk(self, public_pem: str, kid: str | int) -> Dict[str, Any]:
-        pub = serialization.load_pem_public_key(public_pem.encode())
+    @staticmethod
+    def _components(pub) -> Dict[str, str]:
         numbers = pub.public_numbers()
-        return {"kty": "RSA", "n": b64url_uint(numbers.n), "e": b64url_uint(numbers.e),
-                "use": "sig", "alg": "RS256", "kid": str(kid)}
+        return {"n": b64url_uint(numbers.n), "e": b64url_uint(numbers.e)}
 
 # ---------- Ed25519 ----------
 class Ed25519KeyStrategy(KeyStrategy):
     name = "ed25519"
+    kty = "OKP"
+    alg = "EdDSA"
+    crv = "Ed25519"
 
     def generate_pair(self, *, key_size: Optional[int] = None):
         priv = ed25519.Ed25519PrivateKey.generate()
@@ -63,17 +146,20 @@ class Ed25519KeyStrategy(KeyStrategy):
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo,
         ).decode()
-        return priv_pem, pub_pem, {"alg": "EdDSA", "curve": "Ed25519", "key_size": None}
+        return priv_pem, pub_pem, {"alg": "EdDSA", "curve": "Ed25519", "key_size": None,
+                                   "jwk": self._components(priv.public_key())}
 
-    def to_jwk(self, public_pem: str, kid: str | int) -> Dict[str, Any]:
-        pub = serialization.load_pem_public_key(public_pem.encode())
+    @staticmethod
+    def _components(pub) -> Dict[str, str]:
         raw = pub.public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
-        return {"kty": "OKP", "crv": "Ed25519", "x": b64url(raw),
-                "use": "sig", "alg": "EdDSA", "kid": str(kid)}
+        return {"x": b64url(raw)}
 
 # ---------- EC P-256 (ES256) ----------
 class ECP256KeyStrategy(KeyStrategy):
     name = "ec-p256"
+    kty = "EC"
+    alg = "ES256"
+    crv = "P-256"
 
     def generate_pair(self, *, key_size: Optional[int] = None):
         priv = ec.generate_private_key(ec.SECP256R1())
@@ -86,15 +172,15 @@ class ECP256KeyStrategy(KeyStrategy):
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo,
         ).decode()
-        return priv_pem, pub_pem, {"alg": "ES256", "curve": "P-256", "key_size": None}
+        return priv_pem, pub_pem, {"alg": "ES256", "curve": "P-256", "key_size": None,
+                                   "jwk": self._components(priv.public_key())}
 
-    def to_jwk(self, public_pem: str, kid: str | int) -> Dict[str, Any]:
-        pub = serialization.load_pem_public_key(public_pem.encode())
+    @staticmethod
+    def _components(pub) -> Dict[str, str]:
         numbers = pub.public_numbers()
         x = numbers.x.to_bytes(32, "big")
         y = numbers.y.to_bytes(32, "big")
-        return {"kty": "EC", "crv": "P-256", "x": b64url(x), "y": b64url(y),
-                "use": "sig", "alg": "ES256", "kid": str(kid)}
+        return {"x": b64url(x), "y": b64url(y)}
 
 # ---------- registry ----------
 class StrategyRegistry:
@@ -0,0 +1,45 @@
+import itertools
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from strategies import RSAKeyStrategy
+
+RSA_POOL_SIZE = 5
+RSA_POOL_KEY_SIZE = 2048
+
+def _generate_rsa(size):
+    priv = rsa.generate_private_key(public_exponent=65537, key_size=size)
+    priv_pem = priv.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode()
+    pub_pem = priv.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode()
+    return [priv_pem, pub_pem, RSAKeyStrategy._components(priv.public_key())]
+
+@pytest.fixture(scope="session")
+def rsa_keypool():
+    """
+    RSA-2048 test pairs [priv_pem, pub_pem, jwk_components], generated once per session and kept
+    in memory only, so the JWK components always come from the current RSAKeyStrategy code.
+    """
+    return [_generate_rsa(RSA_POOL_KEY_SIZE) for _ in range(RSA_POOL_SIZE)]
+
+@pytest.fixture()
+def fast_rsa_keygen(monkeypatch, rsa_keypool):
+    """Serve RSA-2048 pairs from rsa_keypool; other sizes (and size validation) use the real strategy."""
+    real_generate = RSAKeyStrategy.generate_pair
+    pairs = itertools.cycle(rsa_keypool)
+
+    def generate_pair(self, *, key_size=None):
+        size = key_size or self.default_size
+        if size != RSA_POOL_KEY_SIZE or size not in self.allowed_sizes:
+            return real_generate(self, key_size=key_size)
+        priv_pem, pub_pem, components = next(pairs)
+        return priv_pem, pub_pem, {"alg": "RS256", "curve": None, "key_size": size, "jwk": dict(components)}
+
+    monkeypatch.setattr(RSAKeyStrategy, "generate_pair", generate_pair)
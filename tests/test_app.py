@@ -1,19 +1,28 @@
 from datetime import datetime, timedelta, timezone
 import base64
+import sqlite3
+from types import MappingProxyType
 import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
 
 from app import create_app
 from extensions import db
 from models import KeyPair
+from repositories import SQLAlchemyKeyRepository
+
+# Real RSA keygen is covered in test_strategies.py; HTTP tests reuse pre-generated pairs.
+pytestmark = pytest.mark.usefixtures("fast_rsa_keygen")
 
 def basic(cid, secret):
     token = base64.b64encode(f"{cid}:{secret}".encode()).decode()
     return {"Authorization": f"Basic {token}"}
 
 class TestConfig:
-    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    # No SQLALCHEMY_DATABASE_URI: every fixture subclasses this with its own file DB.
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    DEFAULT_KEY_TYPE = "rsa"
+    # Functional tests don't assert key type; Ed25519 keygen is microseconds. RSA is requested explicitly.
+    DEFAULT_KEY_TYPE = "ed25519"
     DEFAULT_KEY_SIZE = 2048
     DEFAULT_DURATION_DAYS = 90
     ALLOWED_RSA_SIZES = {2048, 3072, 4096}
@@ -38,104 +47,328 @@ class TestConfig:
     LIST_DEFAULT_LIMIT = 50
     LIST_MAX_LIMIT = 200
 
-@pytest.fixture()
-def app():
-    app = create_app(TestConfig)
+# Basic-auth headers built once per account; read-only so tests can't leak edits.
+AUTH = {cid: MappingProxyType(basic(cid, rec["client_secret"]))
+        for cid, rec in TestConfig.INMEM_ACCOUNTS.items()}
+
+def seed_keypairs(session, rows):
+    """Insert KeyPair rows from plain dicts in one bulk INSERT (no unit-of-work bookkeeping)."""
+    session.bulk_insert_mappings(KeyPair, rows)
+    session.commit()
+
+def _fast_sqlite(dbapi_conn, _record):
+    # Throwaway test DB: WAL and no fsync on commit.
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=OFF")
+    cur.close()
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    # One app and schema per session (file DB under tmp, so unique per xdist worker).
+    path = tmp_path_factory.mktemp("db") / "test.db"
+    cfg = type("SessionConfig", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"})
+    app = create_app(cfg)
+    with app.app_context():
+        # create_app() already pooled a connection; drop it so every connection runs the hook.
+        event.listen(db.engine, "connect", _fast_sqlite)
+        db.engine.dispose()
+    yield app
     with app.app_context():
-        db.create_all()
-    return app
+        db.engine.dispose()
+
+@pytest.fixture(autouse=True)
+def _reset_db(app):
+    # Empty every table before each test instead of rebuilding the app and schema.
+    with app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+@pytest.fixture()
+def build_app(tmp_path):
+    # Private app on its own DB, for tests that patch collaborators before create_app runs.
+    def build():
+        cfg = type("PrivateConfig", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'private.db'}"})
+        return create_app(cfg)
+    return build
 
 @pytest.fixture()
 def client(app):
     return app.test_client()
 
+def test_session_db_connections_use_fast_pragmas(app):
+    with app.app_context():
+        assert db.session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert db.session.execute(text("PRAGMA synchronous")).scalar() == 0
+
 def test_missing_auth_rejected(client):
     r = client.post("/tenants/a/keys", json={})
     assert r.status_code == 401
 
 def test_wrong_tenant_forbidden(client):
     # credentials for tenant 'a' hitting tenant 'b'
-    r = client.post("/tenants/b/keys", json={}, headers=basic("creator_a","sa"))
+    r = client.post("/tenants/b/keys", json={}, headers=AUTH["creator_a"])
     assert r.status_code == 403
 
 def test_create_rsa_default(client):
-    r = client.post("/tenants/a/keys", json={}, headers=basic("creator_a","sa"))
+    r = client.post("/tenants/a/keys", json={"key_type": "rsa"}, headers=AUTH["creator_a"])
     assert r.status_code == 201
     d = r.get_json()
     assert d["key_type"] == "rsa" and d["key_size"] == 2048
 
 def test_create_ed25519_and_jwks(client):
-    r = client.post("/tenants/b/keys", json={"key_type": "ed25519", "key_id": 7}, headers=basic("creator_b","sb"))
+    r = client.post("/tenants/b/keys", json={"key_type": "ed25519", "key_id": 7}, headers=AUTH["creator_b"])
     assert r.status_code == 201
     jwks = client.get("/tenants/b/.well-known/jwks.json").get_json()
     assert len(jwks["keys"]) == 1 and jwks["keys"][0]["kty"] == "OKP" and jwks["keys"][0]["kid"] == "7"
 
+def test_jwks_cache_headers(client):
+    r = client.get("/tenants/b/.well-known/jwks.json")
+    assert r.status_code == 200
+    assert r.headers["Cache-Control"] == "public, max-age=300"
+    assert r.headers["ETag"]
+    again = client.get("/tenants/b/.well-known/jwks.json", headers={"If-None-Match": r.headers["ETag"]})
+    assert again.status_code == 304 and again.data == b""
+    stale = client.get("/tenants/b/.well-known/jwks.json", headers={"If-None-Match": '"stale"'})
+    assert stale.status_code == 200
+
+def test_jwks_legacy_rows_parallel_parse_keeps_order(app, client, monkeypatch):
+    monkeypatch.setattr("app.JWKS_PARALLEL_MIN", 2)
+    for kid in (1, 2, 3):
+        client.post("/tenants/b/keys", json={"key_type": "ed25519", "key_id": kid}, headers=AUTH["creator_b"])
+    fresh = client.get("/tenants/b/.well-known/jwks.json").get_json()
+    with app.app_context():
+        KeyPair.query.filter_by(tenant_id="b").update({"jwk_json": None})
+        db.session.commit()
+    assert client.get("/tenants/b/.well-known/jwks.json").get_json() == fresh
+
+def test_jwks_single_key_body_is_stored_jwk_bytes(app, client):
+    client.post("/tenants/b/keys", json={"key_type": "ed25519", "key_id": 9}, headers=AUTH["creator_b"])
+    with app.app_context():
+        stored = KeyPair.query.filter_by(tenant_id="b", key_id=9).one().jwk_json
+    body = client.get("/tenants/b/.well-known/jwks.json").data
+    assert body == b'{"keys":[' + stored.encode() + b"]}"
+
 def test_create_ec_p256_and_jwks(client):
-    r = client.post("/tenants/c/keys", json={"key_type": "ec-p256", "key_id": 55}, headers=basic("creator_c","sc"))
+    r = client.post("/tenants/c/keys", json={"key_type": "ec-p256", "key_id": 55}, headers=AUTH["creator_c"])
     assert r.status_code == 201
     jwks = client.get("/tenants/c/.well-known/jwks.json").get_json()
     j = jwks["keys"][0]
     assert j["kty"] == "EC" and j["crv"] == "P-256" and j["kid"] == "55"
 
+def test_duplicate_key_id_conflicts_and_generated_kid_retries(client, monkeypatch):
+    r = client.post("/tenants/b/keys", json={"key_type": "ed25519", "key_id": 12345678}, headers=AUTH["creator_b"])
+    assert r.status_code == 201
+    dup = client.post("/tenants/b/keys", json={"key_type": "ed25519", "key_id": 12345678}, headers=AUTH["creator_b"])
+    assert dup.status_code == 409
+    # generated kid collides once, then succeeds
+    seq = [12345678, 87654321]
+    monkeypatch.setattr("helpers._random_kid", lambda: seq.pop(0))
+    r2 = client.post("/tenants/b/keys", json={"key_type": "ed25519"}, headers=AUTH["creator_b"])
+    assert r2.status_code == 201 and r2.get_json()["key_id"] == 87654321
+
+def _kp(kid, **overrides):
+    now = datetime.now(timezone.utc)
+    fields = dict(tenant_id="rot", key_id=kid, key_type="ed25519", curve="Ed25519",
+                  private_key_pem="priv", public_key_pem="pub",
+                  created_at=now, expires_at=now + timedelta(days=30), active=True)
+    fields.update(overrides)
+    return KeyPair(**fields)
+
+def test_create_with_deactivate_others_is_atomic_on_app_engine(app, monkeypatch):
+    # Runs on the app's own engine (not a test-bound connection): a failure after the
+    # insert must roll the insert back too.
+    repo = SQLAlchemyKeyRepository()
+    def boom(*args):
+        raise RuntimeError("deactivate failed")
+    with app.app_context():
+        repo.create(_kp(1))
+        monkeypatch.setattr(SQLAlchemyKeyRepository, "_deactivate_others", staticmethod(boom))
+        with pytest.raises(RuntimeError):
+            repo.create(_kp(2), deactivate_others=True)
+        db.session.rollback()
+        assert repo.exists("rot", 1) and not repo.exists("rot", 2)
+
+def test_create_reports_non_kid_integrity_errors(app):
+    repo = SQLAlchemyKeyRepository()
+    with app.app_context():
+        assert repo.create(_kp(1)) is not None
+        assert repo.create(_kp(1)) is None  # kid collision
+        with pytest.raises(IntegrityError):
+            repo.create(_kp(2, public_key_pem=None))  # NOT NULL is not a collision
+        db.session.rollback()
+
+BASELINE_SCHEMA = """
+CREATE TABLE key_pairs (
+    id INTEGER NOT NULL PRIMARY KEY, tenant_id VARCHAR(255) NOT NULL, key_id INTEGER NOT NULL,
+    key_type VARCHAR(32) NOT NULL, curve VARCHAR(32), private_key_pem TEXT NOT NULL,
+    public_key_pem TEXT NOT NULL, key_size INTEGER, created_at DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL, active BOOLEAN NOT NULL,
+    CONSTRAINT uq_tenant_kid UNIQUE (tenant_id, key_id)
+);
+"""
+
+def test_app_upgrades_a_baseline_schema_db(tmp_path):
+    path = tmp_path / "old.db"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+    cfg = type("OldDBConfig", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"})
+    old_client = create_app(cfg).test_client()
+    r = old_client.post("/tenants/b/keys", json={"key_id": 5}, headers=AUTH["creator_b"])
+    assert r.status_code == 201
+    jwks = old_client.get("/tenants/b/.well-known/jwks.json").get_json()
+    assert [k["kid"] for k in jwks["keys"]] == ["5"]
+
+def test_migrate_schema_command_upgrades_a_baseline_schema_db(tmp_path):
+    path = tmp_path / "old.db"
+    cfg = type("OldDBConfig", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"})
+    old_app = create_app(cfg)
+    with sqlite3.connect(path) as conn:  # table replaced after startup, so only the command upgrades it
+        conn.execute("DROP TABLE key_pairs")
+        conn.executescript(BASELINE_SCHEMA)
+    assert old_app.test_cli_runner().invoke(args=["migrate-schema"]).exit_code == 0
+    with sqlite3.connect(path) as conn:
+        assert "jwk_json" in {row[1] for row in conn.execute("PRAGMA table_info(key_pairs)")}
+
 def test_invalid_type_and_invalid_size(client):
-    r1 = client.post("/tenants/a/keys", json={"key_type": "dsa"}, headers=basic("creator_a","sa"))
+    r1 = client.post("/tenants/a/keys", json={"key_type": "dsa"}, headers=AUTH["creator_a"])
     assert r1.status_code == 400
-    r2 = client.post("/tenants/a/keys", json={"key_type": "rsa", "key_size": 1234}, headers=basic("creator_a","sa"))
+    r2 = client.post("/tenants/a/keys", json={"key_type": "rsa", "key_size": 1234}, headers=AUTH["creator_a"])
     assert r2.status_code == 400
 
 def test_rotate_and_deactivate_previous(client):
     # Create with a creator (rotate-only user cannot call create_key)
-    client.post("/tenants/rot/keys", json={"key_id": 10}, headers=basic("creator_rot","src"))
-    client.post("/tenants/rot/keys/rotate", json={"deactivate_previous": True, "key_id": 11}, headers=basic("rot_user","sr"))
+    client.post("/tenants/rot/keys", json={"key_id": 10}, headers=AUTH["creator_rot"])
+    client.post("/tenants/rot/keys/rotate", json={"deactivate_previous": True, "key_id": 11}, headers=AUTH["rot_user"])
     jwks = client.get("/tenants/rot/.well-known/jwks.json").get_json()
     assert len(jwks["keys"]) == 1 and jwks["keys"][0]["kid"] == "11"
 
 def test_disable_requires_role(client):
     # Create with a creator (disable-only user cannot call create_key)
-    r = client.post("/tenants/d/keys", json={}, headers=basic("creator_d","sdc"))
+    r = client.post("/tenants/d/keys", json={}, headers=AUTH["creator_d"])
     kid = r.get_json()["key_id"]
     # viewer cannot disable
-    r_forbidden = client.post(f"/tenants/d/keys/{kid}/disable", headers=basic("lister","sl"))
+    r_forbidden = client.post(f"/tenants/d/keys/{kid}/disable", headers=AUTH["lister"])
     assert r_forbidden.status_code == 403
     # dis_user can disable
-    d = client.post(f"/tenants/d/keys/{kid}/disable", headers=basic("dis_user","sd"))
+    d = client.post(f"/tenants/d/keys/{kid}/disable", headers=AUTH["dis_user"])
     assert d.status_code == 200
     jwks = client.get("/tenants/d/.well-known/jwks.json").get_json()
     assert len(jwks["keys"]) == 0
 
 def test_admin_list_filters_and_pagination(client, app):
     # Create with a creator (viewer cannot call create_key)
-    r1 = client.post("/tenants/list/keys", json={"key_id": 1}, headers=basic("creator_list","slc"))
-    # add expired & inactive directly
+    r1 = client.post("/tenants/list/keys", json={"key_id": 1}, headers=AUTH["creator_list"])
+    assert r1.status_code == 201
+    # add expired & inactive directly; listing never reads key material, so placeholders do
     with app.app_context():
-        active = KeyPair.query.filter_by(tenant_id="list", key_id=r1.get_json()["key_id"]).first()
-        from extensions import db as _db
-        expired = KeyPair(
-            tenant_id="list", key_id=2, key_type="rsa",
-            private_key_pem=active.private_key_pem, public_key_pem=active.public_key_pem,
-            key_size=2048,
-            created_at=datetime.now(timezone.utc) - timedelta(days=10),
-            expires_at=datetime.now(timezone.utc) - timedelta(days=1),
-            active=True,
-        )
-        inactive = KeyPair(
-            tenant_id="list", key_id=3, key_type="rsa",
-            private_key_pem=active.private_key_pem, public_key_pem=active.public_key_pem,
-            key_size=2048,
-            created_at=datetime.now(timezone.utc),
-            expires_at=datetime.now(timezone.utc) + timedelta(days=30),
-            active=False,
-        )
-        _db.session.add_all([expired, inactive]); _db.session.commit()
+        now = datetime.now(timezone.utc)
+        shared = dict(tenant_id="list", key_type="ed25519", curve="Ed25519", key_size=None,
+                      private_key_pem="priv", public_key_pem="pub")
+        seed_keypairs(db.session, [
+            dict(shared, key_id=2, created_at=now - timedelta(days=10), expires_at=now - timedelta(days=1), active=True),
+            dict(shared, key_id=3, created_at=now, expires_at=now + timedelta(days=30), active=False),
+        ])
 
     # Default: unexpired (active+inactive)
-    q1 = client.get("/tenants/list/keys", headers=basic("lister","sl")).get_json()
+    q1 = client.get("/tenants/list/keys", headers=AUTH["lister"]).get_json()
     assert q1["total"] == 2 and len(q1["items"]) == 2
 
     # Include expired
-    q2 = client.get("/tenants/list/keys?include_expired=true", headers=basic("lister","sl")).get_json()
+    q2 = client.get("/tenants/list/keys?include_expired=true", headers=AUTH["lister"]).get_json()
     assert q2["total"] == 3
 
     # Only inactive
-    q3 = client.get("/tenants/list/keys?active=false&include_expired=true", headers=basic("lister","sl")).get_json()
+    q3 = client.get("/tenants/list/keys?active=false&include_expired=true", headers=AUTH["lister"]).get_json()
     assert q3["total"] == 1 and q3["items"][0]["key_id"] == 3
+
+def test_list_cursor_pagination(client):
+    for kid in (21, 22, 23):
+        client.post("/tenants/list/keys", json={"key_type": "ed25519", "key_id": kid},
+                    headers=AUTH["creator_list"])
+    p1 = client.get("/tenants/list/keys?limit=2", headers=AUTH["lister"]).get_json()
+    assert p1["total"] == 3 and len(p1["items"]) == 2 and p1["next_cursor"]
+    p2 = client.get(f"/tenants/list/keys?limit=2&cursor={p1['next_cursor']}", headers=AUTH["lister"]).get_json()
+    assert p2["total"] == 3 and p2["next_cursor"] is None
+    seen = [i["key_id"] for i in p1["items"] + p2["items"]]
+    assert sorted(seen) == [21, 22, 23]
+    bad = client.get("/tenants/list/keys?cursor=zzz", headers=AUTH["lister"])
+    assert bad.status_code == 400
+    for limit in (0, -1):
+        r = client.get(f"/tenants/list/keys?limit={limit}", headers=AUTH["lister"])
+        assert r.status_code == 400
+
+def test_stream_keys_ndjson(client):
+    import json
+    for kid in (31, 32):
+        client.post("/tenants/list/keys", json={"key_type": "ed25519", "key_id": kid}, headers=AUTH["creator_list"])
+    r = client.get("/tenants/list/keys/stream", headers=AUTH["lister"])
+    assert r.status_code == 200 and r.mimetype == "application/x-ndjson"
+    lines = [json.loads(l) for l in r.data.splitlines()]
+    assert [l["key_id"] for l in lines] == [32, 31]
+    assert client.get("/tenants/list/keys/stream").status_code == 401
+
+def _as_row_dict(kp):
+    return {c.name: getattr(kp, c.name) for c in KeyPair.__table__.columns}
+
+class DictRowRepository(SQLAlchemyKeyRepository):
+    """SQLAlchemy storage returning dict rows, the shape PsycopgKeyRepository (dict_row) yields."""
+    def list_keys(self, *args, **kwargs):
+        rows, total = super().list_keys(*args, **kwargs)
+        return [_as_row_dict(r) for r in rows], total
+
+    def iter_keys(self, *args, **kwargs):
+        return (_as_row_dict(r) for r in super().iter_keys(*args, **kwargs))
+
+def test_list_and_stream_accept_mapping_rows(build_app, monkeypatch):
+    import json
+    monkeypatch.setattr("app.SQLAlchemyKeyRepository", DictRowRepository)
+    c = build_app().test_client()
+    for kid in (41, 42):
+        c.post("/tenants/list/keys", json={"key_id": kid}, headers=AUTH["creator_list"])
+    page = c.get("/tenants/list/keys?limit=1", headers=AUTH["lister"]).get_json()
+    assert page["items"][0]["key_id"] == 42 and page["next_cursor"]
+    r = c.get("/tenants/list/keys/stream", headers=AUTH["lister"])
+    assert [json.loads(l)["key_id"] for l in r.data.splitlines()] == [42, 41]
+
+class RecordingJWKSCache:
+    """In-memory stand-in for the JWKS cache backend that records invalidations."""
+    def __init__(self):
+        self.bodies = {}
+        self.invalidated = []
+
+    def get(self, tenant_id):
+        return self.bodies.get(tenant_id), None
+
+    def set(self, tenant_id, body, generation):
+        self.bodies[tenant_id] = body
+
+    def invalidate(self, tenant_id):
+        self.invalidated.append(tenant_id)
+        self.bodies.pop(tenant_id, None)
+
+def test_jwks_cache_hits_skip_repo_and_writes_invalidate(build_app, monkeypatch):
+    cache = RecordingJWKSCache()
+    monkeypatch.setattr("app.NullJWKSCache", lambda: cache)
+    loads = []
+    real_load = SQLAlchemyKeyRepository.list_public_for_jwks
+    def counting_load(self, *args):
+        loads.append(args[0])
+        return real_load(self, *args)
+    monkeypatch.setattr(SQLAlchemyKeyRepository, "list_public_for_jwks", counting_load)
+    c = build_app().test_client()
+
+    c.post("/tenants/rot/keys", json={"key_id": 1}, headers=AUTH["creator_rot"])
+    first = c.get("/tenants/rot/.well-known/jwks.json").data
+    assert c.get("/tenants/rot/.well-known/jwks.json").data == first
+    assert loads == ["rot"]  # second GET served from the cache
+
+    c.post("/tenants/rot/keys/rotate", json={"key_id": 2}, headers=AUTH["rot_user"])
+    assert "rot" not in cache.bodies
+    c.get("/tenants/rot/.well-known/jwks.json")
+    c.post("/tenants/d/keys", json={"key_id": 3}, headers=AUTH["creator_d"])
+    c.get("/tenants/d/.well-known/jwks.json")
+    c.post("/tenants/d/keys/3/disable", headers=AUTH["dis_user"])
+    assert "d" not in cache.bodies
+    assert cache.invalidated == ["rot", "rot", "d", "d"]
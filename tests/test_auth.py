@@ -0,0 +1,76 @@
+import json
+from flask import Flask
+from auth import InMemoryAuthRepository, AWSSecretsAuthRepository, make_require_roles
+
+class NotFound(Exception):
+    response = {"Error": {"Code": "ResourceNotFoundException"}}
+
+class FakeSecretsManager:
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        if SecretId not in self.secrets:
+            raise NotFound()
+        return {"SecretString": json.dumps(self.secrets[SecretId])}
+
+def test_inmemory_authenticate():
+    repo = InMemoryAuthRepository({"c": {"client_secret": "s", "tenant_id": "t", "roles": ["view"]}})
+    assert repo.authenticate("c", "s") == {"tenant_id": "t", "roles": ["view"]}
+    assert repo.authenticate("c", "wrong") is None
+    assert repo.authenticate("c", "sé") is None
+    assert repo.authenticate("nobody", "s") is None
+
+def test_aws_authenticate_caches_secret_lookups():
+    sm = FakeSecretsManager({"p/c": {"client_secret": "s", "tenant_id": "t", "roles": ["view"]}})
+    repo = AWSSecretsAuthRepository(sm, "p/")
+    assert repo.authenticate("c", "s") == {"tenant_id": "t", "roles": ["view"]}
+    assert repo.authenticate("c", "wrong") is None
+    assert repo.authenticate("c", "s") is not None
+    assert sm.calls == 1
+
+def test_aws_authenticate_caches_unknown_clients():
+    sm = FakeSecretsManager({})
+    repo = AWSSecretsAuthRepository(sm, "p")
+    assert repo.authenticate("ghost", "x") is None
+    assert repo.authenticate("ghost", "x") is None
+    assert sm.calls == 1
+
+class CountingAuthRepository(InMemoryAuthRepository):
+    calls = 0
+
+    def authenticate(self, client_id, client_secret):
+        self.calls += 1
+        return super().authenticate(client_id, client_secret)
+
+def _guarded_client(auth_repo, **kw):
+    app = Flask(__name__)
+    require_roles = make_require_roles(auth_repo, **kw)
+
+    @app.get("/tenants/<tenant_id>/ping")
+    @require_roles("view")
+    def ping(tenant_id):
+        return "ok"
+    return app.test_client()
+
+def test_require_roles_caches_successful_principals():
+    repo = CountingAuthRepository({"c": {"client_secret": "s", "tenant_id": "t", "roles": ["view"]}})
+    client = _guarded_client(repo)
+    ok = {"X-Client-Id": "c", "X-Client-Secret": "s"}
+    assert client.get("/tenants/t/ping", headers=ok).status_code == 200
+    assert client.get("/tenants/t/ping", headers=ok).status_code == 200
+    assert repo.calls == 1
+    bad = {"X-Client-Id": "c", "X-Client-Secret": "wrong"}
+    assert client.get("/tenants/t/ping", headers=bad).status_code == 401
+    assert client.get("/tenants/t/ping", headers=bad).status_code == 401
+    assert repo.calls == 3
+
+def test_require_roles_cache_disabled():
+    repo = CountingAuthRepository({"c": {"client_secret": "s", "tenant_id": "t", "roles": ["view"]}})
+    client = _guarded_client(repo, cache_ttl=0)
+    ok = {"X-Client-Id": "c", "X-Client-Secret": "s"}
+    client.get("/tenants/t/ping", headers=ok)
+    client.get("/tenants/t/ping", headers=ok)
+    assert repo.calls == 2
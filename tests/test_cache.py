@@ -0,0 +1,64 @@
+import logging
+from cache import NullJWKSCache, RedisJWKSCache
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def mget(self, *keys):
+        return [self.store.get(k) for k in keys]
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+        self.ttls[key] = ex
+
+    def incr(self, key):
+        self.store[key] = str(int(self.store.get(key, b"0")) + 1).encode()
+        return int(self.store[key])
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+class BrokenRedis:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError("redis down")
+        return fail
+
+def test_null_cache_always_misses():
+    c = NullJWKSCache()
+    c.set("t", b"{}", None)
+    assert c.get("t") == (None, None)
+
+def test_redis_cache_set_get_invalidate():
+    r = FakeRedis()
+    c = RedisJWKSCache(r, ttl=120)
+    body, gen = c.get("t")
+    assert body is None
+    c.set("t", b'{"keys":[]}', gen)
+    assert r.ttls["jwks:t"] == 120
+    assert c.get("t")[0] == b'{"keys":[]}'
+    c.invalidate("t")
+    assert c.get("t")[0] is None
+
+def test_invalidate_between_miss_and_set_drops_the_stale_body():
+    c = RedisJWKSCache(FakeRedis(), ttl=120)
+    _, gen = c.get("t")          # reader misses and goes to the DB
+    c.invalidate("t")            # a key write lands before the reader stores its body
+    c.set("t", b"stale", gen)
+    body, gen = c.get("t")
+    assert body is None
+    c.set("t", b"fresh", gen)
+    assert c.get("t")[0] == b"fresh"
+
+def test_redis_errors_are_misses_and_failed_invalidations_are_logged(caplog):
+    c = RedisJWKSCache(BrokenRedis(), ttl=60)
+    c.set("t", b"{}", b"0")
+    with caplog.at_level(logging.WARNING, logger="cache"):
+        c.invalidate("t")
+    assert "invalidation failed for tenant t" in caplog.text
+    assert c.get("t") == (None, None)
@@ -1,6 +1,6 @@
 import types
 from types import SimpleNamespace
-from helpers import b64url, b64url_uint, now_utc, generate_kid_non_colliding
+from helpers import b64url, b64url_uint, now_utc, insert_with_unique_kid
 import base64
 
 def b64url_decode(s: str) -> bytes:
@@ -17,25 +17,43 @@ def test_b64url_roundtrip():
 def test_b64url_uint_known_values():
     # 65537 (0x10001) => AQAB (common RSA e)
     assert b64url_uint(65537) == "AQAB"
-    # 0 -> empty byte is 0x00 => "AA" after base64 + strip padding -> actually "", but our function encodes integer properly
     assert b64url_uint(1) == "AQ"
-    assert b64url_uint(0) == "AA" or b64url_uint(0) == ""  # tolerate implementation detail
+    assert b64url_uint(0) == "AA"  # zero is one 0x00 octet, never an empty member
 
 def test_now_utc_has_tz():
     t = now_utc()
     assert t.tzinfo is not None and t.utcoffset().total_seconds() == 0
 
-def test_generate_kid_non_colliding_with_collisions(monkeypatch):
+def test_insert_with_unique_kid_retries_collisions(monkeypatch):
     # Simulate two collisions then a unique id
     seq = [11111111, 11111111, 22222222]
-    def fake_randint(a, b):
+    def fake_random_kid():
         return seq.pop(0)
 
-    # exists returns True only for 11111111
+    # the insert reports a (tenant_id, key_id) conflict only for 11111111
     taken = {11111111}
-    def exists_fn(tenant_id, kid):
-        return kid in taken
+    tried = []
+    def insert_fn(kid):
+        tried.append(kid)
+        return kid not in taken
 
-    monkeypatch.setattr("random.randint", fake_randint)
-    kid = generate_kid_non_colliding("t", exists_fn)
-    assert kid == 22222222
+    monkeypatch.setattr("helpers._random_kid", fake_random_kid)
+    kid = insert_with_unique_kid(insert_fn)
+    assert kid == 22222222 and tried == [11111111, 11111111, 22222222]
+
+def test_insert_with_unique_kid_gives_up():
+    import pytest
+    with pytest.raises(RuntimeError):
+        insert_with_unique_kid(lambda kid: False, attempts=3)
+
+def test_cursor_roundtrip_and_rejects_garbage():
+    import pytest
+    from helpers import encode_cursor, decode_cursor
+    t = now_utc()
+    assert decode_cursor(encode_cursor(t, 42)) == (t, 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+def test_random_kid_in_range():
+    from helpers import _random_kid, KID_MIN, KID_MAX
+    assert all(KID_MIN <= _random_kid() <= KID_MAX for _ in range(100))
@@ -1,28 +1,70 @@
+import os
 import pytest
 from datetime import timedelta
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.orm import scoped_session, sessionmaker
 from config import Config
-from extensions import db
+from extensions import db, enable_sqlite_savepoints
 from models import KeyPair
 from repositories import SQLAlchemyKeyRepository
 from helpers import now_utc
 
+# Named shared-cache in-memory DB, one per xdist worker, held open by a single connection.
+_WORKER = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+
 class TestConfig(Config):
-    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    SQLALCHEMY_DATABASE_URI = f"sqlite+pysqlite:///file:keys_{_WORKER}?mode=memory&cache=shared&uri=true"
+    SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"check_same_thread": False}, "poolclass": StaticPool}
     STORAGE_BACKEND = "sqlalchemy"
 
-@pytest.fixture()
+def _sqlite_ddl_script(dialect) -> str:
+    # Whole schema compiled once and replayed in a single native executescript() call.
+    stmts = []
+    for table in db.metadata.sorted_tables:
+        stmts.append(str(CreateTable(table).compile(dialect=dialect)).strip())
+        stmts.extend(str(CreateIndex(ix).compile(dialect=dialect)).strip() for ix in table.indexes)
+    return ";\n".join(stmts) + ";"
+
+@pytest.fixture(scope="session")
 def app():
-    # Minimal app factory inline (matches your existing create_app style)
+    # Minimal app factory inline (matches your existing create_app style); schema built once
     from flask import Flask
     app = Flask(__name__)
     app.config.from_object(TestConfig)
     db.init_app(app)
     with app.app_context():
-        db.create_all()
+        enable_sqlite_savepoints(db.engine)
+        if db.engine.dialect.name == "sqlite":
+            raw = db.engine.raw_connection()
+            try:
+                raw.driver_connection.executescript(_sqlite_ddl_script(db.engine.dialect))
+            finally:
+                raw.close()
+        else:
+            db.create_all()
     yield app
 
 @pytest.fixture()
-def repo(app):
+def db_session(app):
+    # One connection inside an outer transaction: repository commits only release
+    # SAVEPOINTs, and the transaction is rolled back after each test.
+    with app.app_context():
+        connection = db.engine.connect()
+        trans = connection.begin()
+        original = db.session
+        db.session = scoped_session(sessionmaker(bind=connection, join_transaction_mode="create_savepoint"))
+        try:
+            yield db.session
+        finally:
+            db.session.remove()
+            db.session = original
+            trans.rollback()
+            connection.close()
+
+@pytest.fixture()
+def repo(db_session):
     return SQLAlchemyKeyRepository()
 
 def make_kp(tenant="t", kid=1, active=True, expire_in_days=30, key_type="rsa"):
@@ -45,23 +87,30 @@ def test_exists_create_get_one(repo, app):
 def test_get_active_unexpired_and_deactivate(repo, app):
     with app.app_context():
         now = now_utc()
-        repo.create(make_kp("t", 1, active=True, expire_in_days=30))
-        repo.create(make_kp("t", 2, active=True, expire_in_days=-1))   # expired
-        repo.create(make_kp("t", 3, active=False, expire_in_days=30))  # inactive
+        repo.create_many([
+            make_kp("t", 1, active=True, expire_in_days=30),
+            make_kp("t", 2, active=True, expire_in_days=-1),   # expired
+            make_kp("t", 3, active=False, expire_in_days=30),  # inactive
+        ])
 
         active_unexpired = repo.get_active_unexpired("t", now)
         assert [k.key_id for k in active_unexpired] == [1]
+        assert [tuple(r) for r in repo.list_public_for_jwks("t", now)] == [(1, "rsa", "pub", None)]
 
-        # deactivate others (none besides key 1)
+        # deactivate others: the expired-but-active key 2 is flipped as well
         changed = repo.deactivate_others("t", exclude_key_id=1, now=now)
-        assert changed == 0
+        assert changed == 1
+        assert repo.get_one("t", 2).active is False
+        assert repo.get_one("t", 1).active is True
 
 def test_list_and_save(repo, app):
     with app.app_context():
         now = now_utc()
-        repo.create(make_kp("t", 1, active=True, expire_in_days=30))
-        repo.create(make_kp("t", 2, active=True, expire_in_days=-1))  # expired
-        repo.create(make_kp("t", 3, active=False, expire_in_days=30))
+        repo.create_many([
+            make_kp("t", 1, active=True, expire_in_days=30),
+            make_kp("t", 2, active=True, expire_in_days=-1),  # expired
+            make_kp("t", 3, active=False, expire_in_days=30),
+        ])
 
         rows, total = repo.list_keys("t", active=None, include_expired=False, now=now, limit=50, offset=0)
         # unexpired keys: ids 1 and 3
@@ -77,3 +126,84 @@ def test_list_and_save(repo, app):
         one.active = False
         repo.save(one)
         assert repo.get_one("t", 1).active is False
+
+def test_create_many_skips_conflicting_kids(repo, app):
+    with app.app_context():
+        repo.create(make_kp("t", 1))
+        created = repo.create_many([make_kp("t", 1), make_kp("t", 2), make_kp("t", 3)])
+        assert [kp.key_id for kp in created] == [2, 3]
+        assert all(repo.exists("t", kid) for kid in (1, 2, 3))
+        assert repo.create_many([]) == []
+
+def test_list_total_survives_offset_past_end(repo, app):
+    with app.app_context():
+        now = now_utc()
+        repo.create(make_kp("t", 1))
+        repo.create(make_kp("t", 2))
+        rows, total = repo.list_keys("t", active=None, include_expired=False, now=now, limit=1, offset=1)
+        assert total == 2 and len(rows) == 1
+        rows, total = repo.list_keys("t", active=None, include_expired=False, now=now, limit=1, offset=5)
+        assert total == 2 and rows == []
+
+def test_list_keys_is_a_single_query(repo, app):
+    with app.app_context():
+        now = now_utc()
+        for kid in (1, 2, 3):
+            repo.create(make_kp("t", kid))
+        statements = []
+        def record(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith("SELECT"):
+                statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            rows, total = repo.list_keys("t", active=None, include_expired=False, now=now, limit=2, offset=0)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        assert total == 3 and len(rows) == 2
+        assert len(statements) == 1
+
+def test_list_keyset_pagination(repo, app):
+    with app.app_context():
+        now = now_utc()
+        for kid in (1, 2, 3):
+            kp = make_kp("t", kid)
+            kp.created_at = now  # identical timestamps: id breaks the tie
+            repo.create(kp)
+        rows, total = repo.list_keys("t", active=None, include_expired=False, now=now, limit=2, offset=0)
+        assert total == 3 and [r.key_id for r in rows] == [3, 2]
+        last = rows[-1]
+        rows, total = repo.list_keys("t", active=None, include_expired=False, now=now, limit=2, offset=0,
+                                     after=(last.created_at, last.id))
+        assert total == 3 and [r.key_id for r in rows] == [1]
+
+def test_create_with_deactivate_others(repo, app):
+    with app.app_context():
+        repo.create(make_kp("t", 1))
+        repo.create(make_kp("t", 2), deactivate_others=True)
+        assert repo.get_one("t", 1).active is False
+        assert repo.get_one("t", 2).active is True
+
+def test_create_conflicting_kid_returns_none(repo, app):
+    with app.app_context():
+        assert repo.create(make_kp("t", 1)) is not None
+        dup = make_kp("t", 1)
+        assert repo.create(dup) is None
+        dup.key_id = 2
+        assert repo.create(dup) is dup
+        assert repo.exists("t", 2)
+
+def test_list_public_for_jwks_prefers_precomputed_jwk(repo, app):
+    with app.app_context():
+        kp = make_kp("t", 1)
+        kp.jwk_json = '{"kid":"1"}'
+        repo.create(kp)
+        assert [tuple(r) for r in repo.list_public_for_jwks("t", now_utc())] == [(1, "rsa", None, '{"kid":"1"}')]
+
+def test_iter_keys(repo, app):
+    with app.app_context():
+        repo.create(make_kp("t", 1))
+        repo.create(make_kp("t", 2, active=False))
+        repo.create(make_kp("t", 3, expire_in_days=-1))
+        now = now_utc()
+        assert sorted(k.key_id for k in repo.iter_keys("t", active=None, include_expired=False, now=now)) == [1, 2]
+        assert [k.key_id for k in repo.iter_keys("t", active=False, include_expired=True, now=now)] == [2]
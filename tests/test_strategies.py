@@ -1,8 +1,14 @@
 import base64
-from strategies import RSAKeyStrategy, Ed25519KeyStrategy, ECP256KeyStrategy
+import functools
+from strategies import RSAKeyPool, RSAKeyStrategy, Ed25519KeyStrategy, ECP256KeyStrategy
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, ed25519, ec
 
+@functools.lru_cache(maxsize=64)
+def load_pub(pub_pem: str):
+    # Independent of strategies' own parse cache; memoized since tests inspect the same PEM repeatedly.
+    return serialization.load_pem_public_key(pub_pem.encode())
+
 def b64url_decode(s: str) -> bytes:
     pad = "=" * (-len(s) % 4)
     return base64.urlsafe_b64decode(s + pad)
@@ -13,7 +19,7 @@ def test_rsa_strategy_generate_and_jwk():
     assert meta["alg"] == "RS256" and meta["curve"] is None and meta["key_size"] == 2048
 
     # public key loads
-    pub = serialization.load_pem_public_key(pub_pem.encode())
+    pub = load_pub(pub_pem)
     assert isinstance(pub, rsa.RSAPublicKey)
     numbers = pub.public_numbers()
 
@@ -28,7 +34,7 @@ def test_ed25519_strategy_generate_and_jwk():
     priv_pem, pub_pem, meta = s.generate_pair()
     assert meta["alg"] == "EdDSA" and meta["curve"] == "Ed25519" and meta["key_size"] is None
 
-    pub = serialization.load_pem_public_key(pub_pem.encode())
+    pub = load_pub(pub_pem)
     assert isinstance(pub, ed25519.Ed25519PublicKey)
     raw = pub.public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
 
@@ -42,7 +48,7 @@ def test_ec_p256_strategy_generate_and_jwk():
     priv_pem, pub_pem, meta = s.generate_pair()
     assert meta["alg"] == "ES256" and meta["curve"] == "P-256"
 
-    pub = serialization.load_pem_public_key(pub_pem.encode())
+    pub = load_pub(pub_pem)
     assert isinstance(pub, ec.EllipticCurvePublicKey)
     nums = pub.public_numbers()
     x_bytes = nums.x.to_bytes(32, "big")
@@ -52,3 +58,34 @@ def test_ec_p256_strategy_generate_and_jwk():
     assert jwk["kty"] == "EC" and jwk["crv"] == "P-256" and jwk["kid"] == "55"
     assert b64url_decode(jwk["x"]) == x_bytes
     assert b64url_decode(jwk["y"]) == y_bytes
+
+def test_to_jwk_is_memoized_and_returns_copies():
+    s = Ed25519KeyStrategy()
+    _, pub_pem, _ = s.generate_pair()
+    a = s.to_jwk(pub_pem, kid=1)
+    a["kid"] = "mutated"
+    b = s.to_jwk(pub_pem, kid=1)
+    assert b["kid"] == "1"
+    assert s.to_jwk(pub_pem, kid=2)["kid"] == "2"
+
+def test_jwk_from_components_matches_pem_path():
+    for s in (RSAKeyStrategy(allowed_sizes={2048}, default_size=2048), Ed25519KeyStrategy(), ECP256KeyStrategy()):
+        _, pub_pem, meta = s.generate_pair()
+        assert s.to_jwk_from_components(meta["jwk"], kid=9) == s.to_jwk(pub_pem, kid=9)
+
+def test_rsa_strategy_uses_pregenerated_pool():
+    pool = RSAKeyPool(target=1, workers=1)
+    try:
+        pool.warm(2048)
+        ready = pool.take(2048, timeout=30)
+        assert isinstance(ready, rsa.RSAPrivateKey) and ready.key_size == 2048
+        pool._queues[2048].get(timeout=30)  # refill scheduled by take()
+        pool._queues[2048].put_nowait(ready)
+        s = RSAKeyStrategy(allowed_sizes={2048}, default_size=2048, pool=pool)
+        _, pub_pem, meta = s.generate_pair()
+        pub = load_pub(pub_pem)
+        assert pub.public_numbers() == ready.public_key().public_numbers()
+        assert meta["key_size"] == 2048
+        assert pool.take(3072) is None  # cold size: caller generates inline
+    finally:
+        pool.close()